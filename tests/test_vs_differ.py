@@ -5,10 +5,34 @@ from pathlib import Path
 # Add parent directory to path so we can import vs_differ
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import datetime as dt
+import json
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures.process import BrokenProcessPool
 from typing import cast
 from unittest.mock import Mock, patch
-from vs_differ import expand_valueset_count, build_rows
+
+import requests
+import vs_differ
+from vs_differ import (
+    Binding,
+    ExpandCache,
+    build_rows,
+    compute_versions,
+    expand_valueset_count,
+    expand_valueset_counts_async,
+    expand_valueset_counts_batch,
+    parse_int,
+    parse_version_date,
+    scan_package,
+    scan_packages,
+    validate_versions_cached,
+    validate_versions_on_server,
+)
 
 
 class FakeResponse:
@@ -16,32 +40,104 @@ class FakeResponse:
         self.status_code = status_code
         self._payload = payload
 
+    @property
+    def content(self):
+        return json.dumps(self._payload).encode("utf-8")
+
     def json(self):
         return self._payload
 
 
+class SlowExpandServer:
+    """Local FHIR stub that answers every $expand after a delay, tracking peak concurrency."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.in_flight += 1
+                    server.peak = max(server.peak, server.in_flight)
+                time.sleep(server.delay)
+                with server._lock:
+                    server.in_flight -= 1
+                body = json.dumps({"expansion": {"total": 5}}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self._httpd.server_port}/fhir"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def pending_pairs(count):
+    return {(f"http://healthterminologies.gov.au/valueset/{i}", "20240131"): None for i in range(count)}
+
+
+class ComputeVersionsTests(unittest.TestCase):
+    def test_month_ends_span_year_boundary_and_leap_february(self):
+        versions = compute_versions(4, dt.date(2024, 2, 10))
+        self.assertEqual(versions, ["20240229", "20240131", "20231231", "20231130"])
+
+    def test_non_positive_count_is_empty(self):
+        self.assertEqual(compute_versions(0, dt.date(2024, 2, 10)), [])
+
+
+class ParseIntTests(unittest.TestCase):
+    def test_only_plain_digit_strings_are_parsed(self):
+        self.assertEqual(parse_int(" 42 ", -1), 42)
+        for value in ("+5", "-5", "1_000", "4.0", "", None):
+            self.assertEqual(parse_int(value, -1), -1, value)
+
+
+class ParseVersionDateTests(unittest.TestCase):
+    def test_only_real_yyyymmdd_dates_are_parsed(self):
+        self.assertEqual(parse_version_date("20240229"), dt.date(2024, 2, 29))
+        for value in ("20241399", "20230229", "2024013", "２０２４０１３１"):
+            with self.assertRaises(ValueError, msg=value):
+                parse_version_date(value)
+
+
 class ExpandValueSetCountTests(unittest.TestCase):
     def test_total_int_is_used(self):
         response = FakeResponse(200, {"expansion": {"total": 42}})
-        with patch("requests.get", return_value=response):
+        with patch("requests.Session.get", return_value=response):
             count, title = expand_valueset_count("https://example.com", "http://vs", "20240131")
         self.assertEqual(count, 42)
 
     def test_total_string_is_parsed(self):
         response = FakeResponse(200, {"expansion": {"total": "7"}})
-        with patch("requests.get", return_value=response):
+        with patch("requests.Session.get", return_value=response):
             count, title = expand_valueset_count("https://example.com", "http://vs", "20240131")
         self.assertEqual(count, 7)
 
     def test_contains_list_is_counted(self):
         response = FakeResponse(200, {"expansion": {"contains": [{"code": "a"}, {"code": "b"}]}})
-        with patch("requests.get", return_value=response):
+        with patch("requests.Session.get", return_value=response):
             count, title = expand_valueset_count("https://example.com", "http://vs", "20240131")
         self.assertEqual(count, 2)
 
     def test_unexpected_expansion_returns_none(self):
         response = FakeResponse(200, {"expansion": {"contains": "not-a-list"}})
-        with patch("requests.get", return_value=response):
+        with patch("requests.Session.get", return_value=response):
             with self.assertLogs(level="WARNING"):
                 count, title = expand_valueset_count(
                     "https://example.com", "http://vs", "20240131"
@@ -49,19 +145,185 @@ class ExpandValueSetCountTests(unittest.TestCase):
         self.assertIsNone(count)
 
 
+class ExpandValueSetCountsBatchTests(unittest.TestCase):
+    def test_entries_are_mapped_back_in_order(self):
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "batch-response",
+            "entry": [
+                {"response": {"status": "200 OK"}, "resource": {"title": "A", "expansion": {"total": 3}}},
+                {"response": {"status": "404 Not Found"}, "resource": {"resourceType": "OperationOutcome"}},
+            ],
+        }
+        session = Mock()
+        session.post.return_value = FakeResponse(200, bundle)
+        with self.assertLogs(level="WARNING"):
+            results = expand_valueset_counts_batch(
+                "https://example.com", "20240131", [("http://vs/a", None), ("http://vs/b", None)], session=session
+            )
+
+        self.assertEqual(results, [(3, "A"), (None, None)])
+        posted = session.post.call_args.kwargs["json"]
+        self.assertEqual(posted["type"], "batch")
+        self.assertTrue(posted["entry"][1]["request"]["url"].startswith("ValueSet/$expand?url=http%3A//vs/b"))
+
+    def test_failed_batch_returns_none(self):
+        session = Mock()
+        session.post.return_value = FakeResponse(400, {})
+        with self.assertLogs(level="WARNING"):
+            results = expand_valueset_counts_batch(
+                "https://example.com", "20240131", [("http://vs/a", None)], session=session
+            )
+        self.assertIsNone(results)
+
+    def test_build_rows_falls_back_to_single_expands(self):
+        with patch("requests.Session.post", return_value=FakeResponse(400, {})), \
+                patch("requests.Session.get", return_value=FakeResponse(200, {"expansion": {"total": 6}})) as get, \
+                self.assertLogs(level="WARNING"):
+            rows = build_rows(
+                [Binding("http://healthterminologies.gov.au/valueset/a")], {}, ["20240131"],
+                "https://example.com", batch=True,
+            )
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(rows[0]["20240131"], 6)
+
+    def test_build_rows_batch_keeps_custom_expand_func(self):
+        expand = Mock(return_value=(6, None))
+        with patch("requests.Session.post") as post:
+            rows = build_rows(
+                [Binding("http://healthterminologies.gov.au/valueset/a")], {}, ["20240131"],
+                "https://example.com", expand_func=expand, batch=True,
+            )
+        post.assert_not_called()
+        self.assertEqual(expand.call_count, 1)
+        self.assertEqual(rows[0]["20240131"], 6)
+
+    def test_build_rows_splits_large_batches(self):
+        def fake_post(url, json=None, headers=None, timeout=None):
+            entries = [{"response": {"status": "200 OK"}, "resource": {"expansion": {"total": 1}}}] * len(json["entry"])
+            return FakeResponse(200, {"resourceType": "Bundle", "type": "batch-response", "entry": entries})
+
+        bindings = [Binding(f"http://healthterminologies.gov.au/valueset/{name}") for name in "abc"]
+        with patch("vs_differ.BATCH_SIZE", 2), patch("requests.Session.post", side_effect=fake_post) as post:
+            rows = build_rows(bindings, {}, ["20240131"], "https://example.com", batch=True)
+        self.assertEqual(sorted(len(call.kwargs["json"]["entry"]) for call in post.call_args_list), [1, 2])
+        self.assertEqual([row["20240131"] for row in rows], [1, 1, 1])
+
+
+class AsyncExpandTests(unittest.TestCase):
+    @unittest.skipUnless(vs_differ.AIOHTTP_AVAILABLE, "aiohttp is not installed")
+    def test_aiohttp_queued_requests_do_not_time_out(self):
+        # Eight 0.4 s requests two at a time take 1.6 s, longer than the 1 s
+        # read timeout, so only requests that are actually sent may be timed
+        with SlowExpandServer(0.4) as server, patch("vs_differ.HTTP2_AVAILABLE", False), \
+                patch("vs_differ.REQUEST_TIMEOUT", (1, 1)):
+            results = expand_valueset_counts_async(server.endpoint, pending_pairs(8), concurrency=2)
+        self.assertEqual(set(results.values()), {(5, None)})
+        self.assertLessEqual(server.peak, 2)
+
+    @unittest.skipUnless(vs_differ.HTTP2_AVAILABLE, "httpx and h2 are not installed")
+    def test_http2_driver_runs_concurrency_requests_over_plain_http(self):
+        # Plain HTTP falls back to HTTP/1.1, one request per connection, so the
+        # connection pool must not cap requests below the concurrency limit
+        with SlowExpandServer(0.5) as server:
+            results = expand_valueset_counts_async(server.endpoint, pending_pairs(8), concurrency=8)
+        self.assertEqual(set(results.values()), {(5, None)})
+        self.assertGreater(server.peak, 4)
+        self.assertLessEqual(server.peak, 8)
+
+
+class ValidateVersionsTests(unittest.TestCase):
+    valueset_index = {"http://healthterminologies.gov.au/valueset/a": {}}
+
+    def test_codesystem_search_decides_availability(self):
+        expands = []
+
+        def fake_get(url, params=None, timeout=None):
+            if not url.endswith("/CodeSystem"):
+                expands.append(url)
+                return FakeResponse(404, {})
+            found = params["version"].endswith("/20240131")
+            return FakeResponse(200, {"resourceType": "Bundle", "total": 1 if found else 0})
+
+        with patch("requests.Session.get", side_effect=fake_get), self.assertLogs(level="WARNING"):
+            versions = validate_versions_on_server(
+                "https://example.com", self.valueset_index, ["20240229", "20240131"]
+            )
+        self.assertEqual(versions, ["20240131"])
+        # Only the version the search did not find needed an $expand
+        self.assertEqual(len(expands), 1)
+        self.assertIn("20240229", expands[0])
+
+    def test_empty_codesystem_search_falls_back_to_expand(self):
+        # Servers that do not index SNOMED CT editions as CodeSystems answer
+        # every search with an empty Bundle
+        def fake_get(url, params=None, timeout=None):
+            if url.endswith("/CodeSystem"):
+                return FakeResponse(200, {"resourceType": "Bundle", "total": 0})
+            return FakeResponse(200, {"expansion": {"total": 3}})
+
+        with patch("requests.Session.get", side_effect=fake_get):
+            versions = validate_versions_on_server(
+                "https://example.com", self.valueset_index, ["20240229", "20240131"]
+            )
+        self.assertEqual(versions, ["20240229", "20240131"])
+
+    def test_falls_back_to_expand_when_search_fails(self):
+        def fake_get(url, params=None, timeout=None):
+            if url.endswith("/CodeSystem"):
+                return FakeResponse(404, {})
+            return FakeResponse(200, {"expansion": {"total": 3}})
+
+        with patch("requests.Session.get", side_effect=fake_get):
+            versions = validate_versions_on_server("https://example.com", self.valueset_index, ["20240131"])
+        self.assertEqual(versions, ["20240131"])
+
+    def test_cached_results_are_reused_the_same_day(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, "cache", "versions.json")
+            with patch("vs_differ.validate_versions_on_server", return_value=["20240131"]) as validate:
+                first = validate_versions_cached(
+                    "https://example.com", self.valueset_index, ["20240229", "20240131"], cache_path
+                )
+                second = validate_versions_cached(
+                    "https://example.com", self.valueset_index, ["20240229", "20240131"], cache_path
+                )
+        self.assertEqual(first, ["20240131"])
+        self.assertEqual(second, ["20240131"])
+        # The unavailable version is asked about again; the available one is not
+        self.assertEqual([call.args[2] for call in validate.call_args_list], [["20240229", "20240131"], ["20240229"]])
+
+    def test_outage_is_not_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, "cache", "versions.json")
+            with patch("requests.Session.get", side_effect=requests.ConnectionError("down")), \
+                    self.assertLogs(level="WARNING"):
+                during = validate_versions_cached(
+                    "https://example.com", self.valueset_index, ["20240131"], cache_path
+                )
+            with patch("requests.Session.get", return_value=FakeResponse(200, {"total": 1})) as get:
+                after = validate_versions_cached(
+                    "https://example.com", self.valueset_index, ["20240131"], cache_path
+                )
+            self.assertEqual(os.listdir(os.path.dirname(cache_path)), ["versions.json"])
+        self.assertEqual(during, [])
+        self.assertEqual(after, ["20240131"])
+        get.assert_called()
+
+
 class BuildRowsTests(unittest.TestCase):
     def test_only_ncts_valuesets_are_included(self):
         deduped = [
-            {
-                "valueset_url": "http://healthterminologies.gov.au/valueset/test",
-                "structure_definition_url": "http://example.org/StructureDefinition/One",
-                "structure_definition_name": "One",
-            },
-            {
-                "valueset_url": "http://example.org/valueset/other",
-                "structure_definition_url": "http://example.org/StructureDefinition/Two",
-                "structure_definition_name": "Two",
-            },
+            Binding(
+                "http://healthterminologies.gov.au/valueset/test",
+                "http://example.org/StructureDefinition/One",
+                "One",
+            ),
+            Binding(
+                "http://example.org/valueset/other",
+                "http://example.org/StructureDefinition/Two",
+                "Two",
+            ),
         ]
         valueset_index = {
             "http://healthterminologies.gov.au/valueset/test": {"name": "Test VS"},
@@ -78,6 +340,196 @@ class BuildRowsTests(unittest.TestCase):
         self.assertEqual(len(sds), 1)
         self.assertEqual(sds[0], ("One", "http://example.org/StructureDefinition/One"))
 
+    def test_version_counts_are_filled_from_parallel_expansions(self):
+        deduped = [
+            Binding(
+                "http://healthterminologies.gov.au/valueset/a",
+                "http://example.org/StructureDefinition/One",
+                "One",
+            ),
+            Binding(
+                "http://healthterminologies.gov.au/valueset/b",
+                "http://example.org/StructureDefinition/Two",
+                "Two",
+            ),
+        ]
+        valueset_index = {"http://healthterminologies.gov.au/valueset/a": {"name": "A"}}
+        counts = {
+            ("http://healthterminologies.gov.au/valueset/a", "20240131"): 10,
+            ("http://healthterminologies.gov.au/valueset/a", "20231231"): 9,
+            ("http://healthterminologies.gov.au/valueset/b", "20240131"): 5,
+        }
+
+        def fake_expand(endpoint, valueset_url, version, valueset_def=None):
+            return counts.get((valueset_url, version)), "Title " + valueset_url[-1]
+
+        rows = build_rows(
+            deduped, valueset_index, ["20240131", "20231231"], "https://example.com",
+            expand_func=fake_expand, max_workers=4,
+        )
+
+        self.assertEqual([row["valueset_name"] for row in rows], ["A", "Title b"])
+        self.assertEqual((rows[0]["20240131"], rows[0]["20231231"]), (10, 9))
+        self.assertEqual((rows[1]["20240131"], rows[1]["20231231"]), (5, ""))
+
+
+class ScanPackageTests(unittest.TestCase):
+    def write_resource(self, folder, filename, resource):
+        with open(os.path.join(folder, filename), "w", encoding="utf-8") as handle:
+            json.dump(resource, handle)
+
+    def test_bindings_and_valuesets_are_collected_in_one_pass(self):
+        with tempfile.TemporaryDirectory() as package_dir:
+            self.write_resource(package_dir, "StructureDefinition-one.json", {
+                "resourceType": "StructureDefinition",
+                "url": "http://example.org/StructureDefinition/One",
+                "name": "One",
+                "snapshot": {"element": [{"binding": {"valueSet": " http://vs/a "}}, {"path": "x"}]},
+                "differential": {"element": [{"binding": {"valueSet": "http://vs/b"}}]},
+            })
+            self.write_resource(package_dir, "ValueSet-a.json", {
+                "resourceType": "ValueSet", "url": "http://vs/a", "name": "A",
+            })
+            self.write_resource(package_dir, "CodeSystem-c.json", {
+                "resourceType": "CodeSystem", "url": "http://cs/c",
+            })
+
+            bound_valuesets, valuesets = scan_package(package_dir)
+
+        self.assertEqual(
+            [item.valueset_url for item in bound_valuesets], ["http://vs/a", "http://vs/b"]
+        )
+        self.assertEqual(bound_valuesets[0].structure_definition_name, "One")
+        self.assertEqual(list(valuesets), ["http://vs/a"])
+
+    def test_package_index_skips_files_without_opening_them(self):
+        with tempfile.TemporaryDirectory() as package_dir:
+            self.write_resource(package_dir, ".index.json", {
+                "index-version": 1,
+                "files": [{"filename": "ValueSet-a.json", "resourceType": "Library"}],
+            })
+            self.write_resource(package_dir, "ValueSet-a.json", {
+                "resourceType": "ValueSet", "url": "http://vs/a",
+            })
+            self.write_resource(package_dir, "ValueSet-b.json", {
+                "resourceType": "ValueSet", "url": "http://vs/b",
+            })
+
+            _, valuesets = scan_package(package_dir)
+
+        self.assertEqual(list(valuesets), ["http://vs/b"])
+
+    def test_scan_packages_preserves_package_order(self):
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            self.write_resource(first, "ValueSet-a.json", {"resourceType": "ValueSet", "url": "http://vs/a"})
+            self.write_resource(second, "ValueSet-b.json", {"resourceType": "ValueSet", "url": "http://vs/b"})
+
+            results = list(scan_packages([first, second], max_workers=2))
+
+        self.assertEqual([list(valuesets) for _, valuesets in results], [["http://vs/a"], ["http://vs/b"]])
+
+    def test_scan_packages_falls_back_to_threads(self):
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            self.write_resource(first, "ValueSet-a.json", {"resourceType": "ValueSet", "url": "http://vs/a"})
+            self.write_resource(second, "ValueSet-b.json", {"resourceType": "ValueSet", "url": "http://vs/b"})
+
+            with patch("vs_differ.ProcessPoolExecutor", side_effect=NotImplementedError("no sem_open")), \
+                    self.assertLogs(level="WARNING"):
+                results = list(scan_packages([first, second], max_workers=2))
+
+        self.assertEqual([list(valuesets) for _, valuesets in results], [["http://vs/a"], ["http://vs/b"]])
+
+    def test_scan_packages_rescans_with_threads_when_workers_fail(self):
+        class BrokenPool:
+            def __init__(self, max_workers=None):
+                pass
+
+            def map(self, func, items):
+                raise BrokenProcessPool("worker failed to start")
+                yield
+
+            def shutdown(self, wait=True):
+                pass
+
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            self.write_resource(first, "ValueSet-a.json", {"resourceType": "ValueSet", "url": "http://vs/a"})
+            self.write_resource(second, "ValueSet-b.json", {"resourceType": "ValueSet", "url": "http://vs/b"})
+
+            with patch("vs_differ.ProcessPoolExecutor", BrokenPool), self.assertLogs(level="WARNING"):
+                results = list(scan_packages([first, second], max_workers=2))
+
+        self.assertEqual([list(valuesets) for _, valuesets in results], [["http://vs/a"], ["http://vs/b"]])
+
+    def test_scan_packages_reuses_cached_scan_until_files_change(self):
+        with tempfile.TemporaryDirectory() as package_dir, tempfile.TemporaryDirectory() as cache_folder:
+            self.write_resource(package_dir, "ValueSet-a.json", {"resourceType": "ValueSet", "url": "http://vs/a"})
+            list(scan_packages([package_dir], cache_folder=cache_folder))
+
+            with patch("vs_differ.scan_package") as scan:
+                (_, valuesets), = scan_packages([package_dir], cache_folder=cache_folder)
+            scan.assert_not_called()
+            self.assertEqual(list(valuesets), ["http://vs/a"])
+
+            self.write_resource(package_dir, "ValueSet-b.json", {"resourceType": "ValueSet", "url": "http://vs/b"})
+            (_, valuesets), = scan_packages([package_dir], cache_folder=cache_folder)
+            self.assertEqual(sorted(valuesets), ["http://vs/a", "http://vs/b"])
+
+
+class BuildRowsSharedValueSetTests(unittest.TestCase):
+    def test_valueset_bound_twice_is_expanded_once_per_version(self):
+        url = "http://healthterminologies.gov.au/valueset/shared"
+        deduped = [
+            Binding(url, "http://sd/One", "One"),
+            Binding(url, "http://sd/Two", "Two"),
+        ]
+        expand = Mock(return_value=(4, None))
+
+        rows = build_rows(deduped, {}, ["20240131", "20231231"], "https://example.com", expand_func=expand)
+
+        self.assertEqual(expand.call_count, 2)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["structure_definitions"], [("One", "http://sd/One"), ("Two", "http://sd/Two")])
+
+
+class ExpandCacheTests(unittest.TestCase):
+    def test_counts_persist_across_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache", "expand.sqlite")
+            cache = ExpandCache(path)
+            cache.put("https://example.com", "http://vs", "20240131", 42, "Title")
+            cache.close()
+
+            reopened = ExpandCache(path)
+            self.assertEqual(reopened.get("https://example.com", "http://vs", "20240131"), (42, "Title"))
+            self.assertIsNone(reopened.get("https://other.example.com", "http://vs", "20240131"))
+            reopened.close()
+
+            expired = ExpandCache(path, ttl_seconds=-1)
+            self.assertIsNone(expired.get("https://example.com", "http://vs", "20240131", expires=True))
+            self.assertEqual(expired.get("https://example.com", "http://vs", "20240131"), (42, "Title"))
+            expired.close()
+
+            # Older releases are refreshed too, once the longer history TTL passes
+            stale_history = ExpandCache(path, history_ttl_seconds=-1)
+            self.assertIsNone(stale_history.get("https://example.com", "http://vs", "20240131"))
+            stale_history.close()
+
+    def test_build_rows_skips_cached_expansions(self):
+        deduped = [Binding("http://healthterminologies.gov.au/valueset/a")]
+        expand = Mock(return_value=(3, None))
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ExpandCache(os.path.join(tmp, "expand.sqlite"))
+            cache.put("https://example.com", "http://healthterminologies.gov.au/valueset/a", "20240131", 7, None)
+
+            rows = build_rows(
+                deduped, {}, ["20240131", "20231231"], "https://example.com",
+                expand_func=expand, cache=cache,
+            )
+            cache.close()
+
+        self.assertEqual(expand.call_count, 1)
+        self.assertEqual((rows[0]["20240131"], rows[0]["20231231"]), (7, 3))
+
 
 class IntegrationTests(unittest.TestCase):
     """Integration tests that make real HTTP requests to terminology servers."""
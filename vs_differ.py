@@ -1,23 +1,44 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import calendar
 import csv
 import datetime as dt
+import hashlib
+import html
+import importlib.util
 import json
 import logging
 import os
+import pickle
+import sqlite3
 import sys
-from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple, cast
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple, cast
 from urllib.parse import quote
 
 import requests  # type: ignore[import-not-found]
+from requests.adapters import HTTPAdapter  # type: ignore[import-not-found]
+from urllib3.util.retry import Retry  # type: ignore[import-not-found]
 try:
-    import pandas as pd
-    from openpyxl import Workbook
-    from openpyxl.chart import LineChart, Reference
-    EXCEL_AVAILABLE = True
+    import orjson  # type: ignore[import-not-found]
+    json_loads = orjson.loads
 except ImportError:
-    EXCEL_AVAILABLE = False
+    json_loads = json.loads
+try:
+    import ijson  # type: ignore[import-not-found]
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+# The async clients are only imported by the async expansion path, so
+# runs that never use it do not pay for loading them
+AIOHTTP_AVAILABLE = importlib.util.find_spec("aiohttp") is not None
+HTTP2_AVAILABLE = importlib.util.find_spec("httpx") is not None and importlib.util.find_spec("h2") is not None
 
 NCTS_PREFIXES = (
     "http://healthterminologies.gov.au",
@@ -27,16 +48,53 @@ NCTS_PREFIXES = (
     "http://www.abs.gov.au",
 )
 
-SNOMED_AU_SYSTEM = "http://snomed.info/sct/32506021000036107"
-SNOMED_BASE_SYSTEM = "http://snomed.info/sct"
+# Package metadata files that sit alongside resources but are never resources
+PACKAGE_METADATA_FILES = frozenset({"package.json", ".index.json"})
+
+# Interned so that the common exact-match comparisons are identity checks
+SNOMED_AU_SYSTEM = sys.intern("http://snomed.info/sct/32506021000036107")
+SNOMED_BASE_SYSTEM = sys.intern("http://snomed.info/sct")
 
 DEFAULT_CACHE_DIR = "~/.fhir/packages"
 DEFAULT_CONFIG_PATH = "config.json"
+DEFAULT_WORKERS = 16
+# Environment override for the number of concurrent $expand requests
+WORKERS_ENV_VAR = "VSDIFFER_WORKERS"
+DEFAULT_CACHE_TTL_HOURS = 24
+# Counts for older releases still depend on the server's current ValueSet
+# definition, so they are refreshed too, just far less often
+DEFAULT_HISTORY_CACHE_TTL_DAYS = 7
+# (connect, read) timeouts in seconds for terminology server requests
+REQUEST_TIMEOUT = (10, 90)
+# is_change_significant threshold curve, derived from the points (500, 25) and
+# (60,000, 500): the % change required drops as the count grows.
+SIGNIFICANCE_COEFFICIENT = 0.5118
+SIGNIFICANCE_EXPONENT = 0.6257
+# Most $expand entries sent in one batch Bundle
+BATCH_SIZE = 100
+# Dev mode samples from the first this-many NCTS bindings found
+DEV_SAMPLE_WINDOW = 150
+# Bump when scan_package's result shape changes to invalidate pickled scans
+SCAN_CACHE_FORMAT = 1
+# Buffer size for the report writers, so rows are flushed in large blocks
+OUTPUT_BUFFER_SIZE = 1 << 20
+# Line colours for chart series, reused in order when there are more series
+CHART_COLORS = (
+    '#e41a1c', '#377eb8', '#1D7DB3', '#984ea3', '#ff7f00',
+    '#ffff33', '#a65628', '#f781bf', '#999999', '#66c2a5',
+    '#fc8d62', '#8da0cb', '#e78ac3', '#a6d854', '#ffd92f',
+)
+# One chart data point, with its count as a hover tooltip. Points reuse the
+# marker defined in CHART_POINT_SYMBOL rather than each carrying a full circle.
+CHART_POINT_SYMBOL = '<defs><symbol id="pt" overflow="visible"><circle r="4"/></symbol></defs>'
+CHART_POINT_TEMPLATE = '<use href="#pt" x="{x}" y="{y}" fill="{color}"><title>{count:,}</title></use>'
+# Days per month in a common year; month_end_version adjusts February
+MONTH_LENGTHS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
 
 
 def load_config(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as handle:
-        data = json.load(handle)
+    with open(path, "rb") as handle:
+        data = json_loads(handle.read())
         return data if isinstance(data, dict) else {}
 
 
@@ -48,8 +106,9 @@ def parse_int(value: Any, default: int) -> int:
     if isinstance(value, int):
         return value
     if isinstance(value, str):
+        # Only plain ASCII digits; int() alone would also take signs and "1_000"
         stripped = value.strip()
-        if stripped.isdigit():
+        if stripped.isascii() and stripped.isdigit():
             return int(stripped)
     return default
 
@@ -61,21 +120,67 @@ def find_package_dir(cache_dir: str, package_id: str, version: str) -> str:
 
 def read_json_file(path: str) -> Optional[Dict[str, Any]]:
     try:
-        with open(path, "r", encoding="utf-8") as handle:
-            data = json.load(handle)
+        # Both parsers accept raw UTF-8 bytes, so skip the text decoding layer.
+        with open(path, "rb") as handle:
+            data = json_loads(handle.read())
             return data if isinstance(data, dict) else None
-    except (OSError, json.JSONDecodeError):
+    except (OSError, ValueError):
         logging.warning("Failed to read JSON: %s", path)
         return None
 
 
+def read_package_index(package_dir: str) -> Dict[str, str]:
+    """Return {filename: resourceType} from a package's .index.json manifest.
+
+    FHIR packages ship this index so tools can find resources without opening
+    them. Returns an empty dict when the package has no usable index.
+    """
+    index_path = os.path.join(package_dir, ".index.json")
+    if not os.path.isfile(index_path):
+        return {}
+    data = read_json_file(index_path) or {}
+    files = data.get("files")
+    if not isinstance(files, list):
+        return {}
+    return {
+        str(entry["filename"]): str(entry.get("resourceType", ""))
+        for entry in files
+        if isinstance(entry, dict) and entry.get("filename")
+    }
+
+
+def peek_resource_type(path: str) -> Optional[str]:
+    """Return the top-level resourceType of a JSON file by streaming only its start.
+
+    FHIR resources normally lead with resourceType, so parsing stops after the
+    first buffer. Returns None when ijson is unavailable or the type is not found.
+    """
+    if not IJSON_AVAILABLE:
+        return None
+    try:
+        with open(path, "rb") as handle:
+            for prefix, event, value in ijson.parse(handle):
+                if prefix == "resourceType" and event == "string":
+                    return str(value)
+    except (OSError, ValueError, ijson.JSONError):
+        return None
+    return None
+
+
 def list_json_files(folder: str) -> Iterable[str]:
     for entry in os.scandir(folder):
-        if entry.is_file() and entry.name.endswith(".json"):
+        # Check the name first so non-JSON entries never need a stat()
+        if entry.name.endswith(".json") and entry.is_file():
             yield entry.path
 
 
+@lru_cache(maxsize=None)
 def get_package_dependencies(package_dir: str) -> Dict[str, str]:
+    """Return a package's dependencies, reading its package.json once per run.
+
+    IGs usually share most of their dependency tree, so every gather_packages
+    call after the first reuses the parsed manifests. Do not mutate the result.
+    """
     package_json = os.path.join(package_dir, "package.json")
     data = read_json_file(package_json) or {}
     deps = data.get("dependencies") or {}
@@ -84,75 +189,249 @@ def get_package_dependencies(package_dir: str) -> Dict[str, str]:
     return {}
 
 
-def gather_packages(cache_dir: str, root_id: str, root_version: str) -> List[Tuple[str, str, str]]:
+def gather_packages(
+    cache_dir: str, root_id: str, root_version: str, max_workers: int = 8
+) -> List[Tuple[str, str, str]]:
+    """Walk the dependency graph of a package breadth first.
+
+    Each level of the graph is resolved together: the package.json files of the
+    whole frontier are read concurrently, then the next frontier is assembled in
+    order, so packages are returned in the same order as a sequential BFS.
+    """
     visited: Set[Tuple[str, str]] = set()
-    queue: List[Tuple[str, str]] = [(root_id, root_version)]
+    frontier: Deque[Tuple[str, str]] = deque([(root_id, root_version)])
     packages: List[Tuple[str, str, str]] = []
 
-    while queue:
-        package_id, version = queue.pop(0)
-        if (package_id, version) in visited:
-            continue
-        visited.add((package_id, version))
-        package_dir = find_package_dir(cache_dir, package_id, version)
-        if not os.path.isdir(package_dir):
-            logging.warning("Missing package directory: %s", package_dir)
-            continue
-        packages.append((package_id, version, package_dir))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while frontier:
+            level: List[Tuple[str, str, str]] = []
+            while frontier:
+                package_id, version = frontier.popleft()
+                if (package_id, version) in visited:
+                    continue
+                visited.add((package_id, version))
+                package_dir = find_package_dir(cache_dir, package_id, version)
+                if not os.path.isdir(package_dir):
+                    logging.warning("Missing package directory: %s", package_dir)
+                    continue
+                level.append((package_id, version, package_dir))
+            packages.extend(level)
 
-        for dep_id, dep_version in get_package_dependencies(package_dir).items():
-            if (dep_id, dep_version) not in visited:
-                queue.append((dep_id, dep_version))
+            # Only this thread touches visited; the workers just read package.json.
+            for dependencies in executor.map(get_package_dependencies, [entry[2] for entry in level]):
+                for dep_id, dep_version in dependencies.items():
+                    if (dep_id, dep_version) not in visited:
+                        frontier.append((dep_id, dep_version))
 
     return packages
 
 
-def extract_bound_valuesets(package_dir: str) -> List[Dict[str, str]]:
-    bound_valuesets: List[Dict[str, str]] = []
-    for path in list_json_files(package_dir):
-        data = read_json_file(path)
-        if not data or data.get("resourceType") != "StructureDefinition":
+class Binding(NamedTuple):
+    """A valueset bound on an element of a StructureDefinition."""
+
+    valueset_url: str
+    structure_definition_url: str = ""
+    structure_definition_name: str = ""
+
+
+def extract_structure_definition_bindings(data: Mapping[str, Any]) -> List[Binding]:
+    """Return the valueset bindings declared on a parsed StructureDefinition."""
+    bound_valuesets: List[Binding] = []
+    url = data.get("url")
+    name = data.get("name")
+    sections = []
+    for section in ("snapshot", "differential"):
+        block = data.get(section) or {}
+        block_elements = block.get("element") or []
+        if isinstance(block_elements, list):
+            sections.append(block_elements)
+    sd_url = str(url) if url else ""
+    sd_name = str(name) if name else ""
+    # Bind the per-element helpers to locals: this loop runs for every element
+    # of every StructureDefinition in every package.
+    is_instance = isinstance
+    get = dict.get
+    append = bound_valuesets.append
+    # Iterate both element lists in place rather than copying them into one list
+    for element in chain.from_iterable(sections):
+        if not is_instance(element, dict):
             continue
-        url = data.get("url")
-        name = data.get("name")
-        elements = []
-        for section in ("snapshot", "differential"):
-            block = data.get(section) or {}
-            block_elements = block.get("element") or []
-            if isinstance(block_elements, list):
-                elements.extend(block_elements)
-        for element in elements:
-            if not isinstance(element, dict):
-                continue
-            binding = element.get("binding") or {}
-            if not isinstance(binding, dict):
-                continue
-            value_set = binding.get("valueSet")
-            if isinstance(value_set, str) and value_set.strip():
-                bound_valuesets.append(
-                    {
-                        "valueset_url": value_set.strip(),
-                        "structure_definition_url": str(url) if url else "",
-                        "structure_definition_name": str(name) if name else "",
-                    }
-                )
+        binding = get(element, "binding")
+        if not binding or not is_instance(binding, dict):
+            continue
+        value_set = get(binding, "valueSet")
+        if is_instance(value_set, str):
+            value_set = value_set.strip()
+            if value_set:
+                append(Binding(value_set, sd_url, sd_name))
     return bound_valuesets
 
 
-def collect_valuesets(package_dir: str) -> Dict[str, Dict[str, Any]]:
-    valuesets: Dict[str, Dict[str, Any]] = {}
+def _harvest_bindings(
+    data: Dict[str, Any], bound_valuesets: List[Binding], valuesets: Dict[str, Dict[str, Any]]
+) -> None:
+    bound_valuesets.extend(extract_structure_definition_bindings(data))
+
+
+def _index_valueset(
+    data: Dict[str, Any], bound_valuesets: List[Binding], valuesets: Dict[str, Dict[str, Any]]
+) -> None:
+    url = data.get("url")
+    if isinstance(url, str):
+        valuesets.setdefault(url, data)
+
+
+# Resource types scan_package parses, and what it does with each; files of
+# any other type are skipped
+RESOURCE_HANDLERS = {
+    "StructureDefinition": _harvest_bindings,
+    "ValueSet": _index_valueset,
+}
+
+
+def scan_package(
+    package_dir: str, valuesets: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Tuple[List[Binding], Dict[str, Dict[str, Any]]]:
+    """Read every JSON resource in a package once.
+
+    Returns (bound_valuesets, valuesets): the bindings declared by the package's
+    StructureDefinitions and its ValueSets indexed by canonical URL. Pass a shared
+    valuesets dict to add to it in place; a URL already present is kept, so the
+    first package to define a valueset wins.
+    """
+    bound_valuesets: List[Binding] = []
+    if valuesets is None:
+        valuesets = {}
+    indexed_types = read_package_index(package_dir)
     for path in list_json_files(package_dir):
+        filename = os.path.basename(path)
+        if filename in PACKAGE_METADATA_FILES:
+            continue
+        # Bail out on uninteresting resources before paying for a full parse,
+        # trusting the package index and only peeking at unindexed files
+        peeked_type = indexed_types.get(filename) or peek_resource_type(path)
+        if peeked_type is not None and peeked_type not in RESOURCE_HANDLERS:
+            continue
         data = read_json_file(path)
-        if not data or data.get("resourceType") != "ValueSet":
+        if not data:
             continue
-        url = data.get("url")
-        if isinstance(url, str) and url not in valuesets:
-            valuesets[url] = data
-    return valuesets
+        handler = RESOURCE_HANDLERS.get(data.get("resourceType"))
+        if handler is not None:
+            handler(data, bound_valuesets, valuesets)
+    return bound_valuesets, valuesets
+
+
+def package_fingerprint(package_dir: str) -> str:
+    """Hash the names, sizes and mtimes of a package's files.
+
+    Any added, removed or rewritten file changes the fingerprint, which is what
+    invalidates a cached scan.
+    """
+    entries = sorted(
+        (entry.name, stat.st_size, stat.st_mtime_ns)
+        for entry in os.scandir(package_dir)
+        if entry.is_file()
+        for stat in (entry.stat(),)
+    )
+    return hashlib.sha1(repr((SCAN_CACHE_FORMAT, entries)).encode("utf-8")).hexdigest()
+
+
+def _scan_cache_path(cache_folder: str, package_dir: str) -> str:
+    name = hashlib.sha1(os.path.abspath(package_dir).encode("utf-8")).hexdigest()
+    return os.path.join(cache_folder, f"{name}.pickle")
+
+
+def load_cached_scan(
+    cache_folder: str, package_dir: str, fingerprint: str
+) -> Optional[Tuple[List[Binding], Dict[str, Dict[str, Any]]]]:
+    """Return a stored scan_package result if it matches the package's fingerprint."""
+    try:
+        with open(_scan_cache_path(cache_folder, package_dir), "rb") as handle:
+            stored_fingerprint, result = pickle.load(handle)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+        return None
+    return result if stored_fingerprint == fingerprint else None
+
+
+def store_cached_scan(
+    cache_folder: str, package_dir: str, fingerprint: str,
+    result: Tuple[List[Binding], Dict[str, Dict[str, Any]]],
+) -> None:
+    path = _scan_cache_path(cache_folder, package_dir)
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a torn entry
+        with open(path + ".tmp", "wb") as handle:
+            pickle.dump((fingerprint, result), handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except OSError as exc:
+        logging.warning("Could not cache scan of %s: %s", package_dir, exc)
+
+
+def scan_packages(
+    package_dirs: List[str], max_workers: Optional[int] = None, cache_folder: Optional[str] = None
+) -> Iterator[Tuple[List[Binding], Dict[str, Dict[str, Any]]]]:
+    """Scan package directories in worker processes, yielding results in input order.
+
+    JSON parsing is CPU-bound, so separate processes sidestep the GIL. Results
+    come back in the order given, letting callers keep first-wins merging.
+    Where processes cannot be started or the pool breaks, a thread pool still
+    overlaps the file reads. With cache_folder, packages whose files are unchanged since the last run
+    are loaded from a pickled scan instead of being parsed again.
+    """
+    results: Dict[str, Tuple[List[Binding], Dict[str, Dict[str, Any]]]] = {}
+    fingerprints: Dict[str, str] = {}
+    if cache_folder is not None:
+        for package_dir in package_dirs:
+            try:
+                fingerprints[package_dir] = package_fingerprint(package_dir)
+            except OSError:
+                continue
+            cached = load_cached_scan(cache_folder, package_dir, fingerprints[package_dir])
+            if cached is not None:
+                results[package_dir] = cached
+        if results:
+            logging.info("Reused %d of %d package scans from cache", len(results), len(package_dirs))
+
+    to_scan = [package_dir for package_dir in package_dirs if package_dir not in results]
+    executor: Optional[Executor] = None
+    if len(to_scan) <= 1 or max_workers == 1:
+        scanned = map(scan_package, to_scan)
+    else:
+        try:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            scanned = executor.map(scan_package, to_scan)
+        except (NotImplementedError, OSError, ImportError, BrokenProcessPool) as exc:
+            logging.warning("Process pool unavailable (%s); scanning packages with threads", exc)
+            if executor is not None:
+                executor.shutdown()
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            scanned = executor.map(scan_package, to_scan)
+    done = 0
+    try:
+        for package_dir in package_dirs:
+            result = results.get(package_dir)
+            if result is None:
+                try:
+                    result = next(scanned)
+                except BrokenProcessPool as exc:
+                    # Workers can also die after the pool starts; rescan what is left on threads
+                    logging.warning("Process pool failed (%s); scanning remaining packages with threads", exc)
+                    cast(Executor, executor).shutdown()
+                    executor = ThreadPoolExecutor(max_workers=max_workers)
+                    scanned = executor.map(scan_package, to_scan[done:])
+                    result = next(scanned)
+                done += 1
+                if package_dir in fingerprints:
+                    store_cached_scan(cast(str, cache_folder), package_dir, fingerprints[package_dir], result)
+            yield result
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 
 def is_ncts_valueset(url: str) -> bool:
-    return any(url.startswith(prefix) for prefix in NCTS_PREFIXES)
+    return url.startswith(NCTS_PREFIXES)
 
 
 def has_snomed_au_content(valueset: Mapping[str, Any]) -> bool:
@@ -168,7 +447,8 @@ def has_snomed_au_content(valueset: Mapping[str, Any]) -> bool:
         system = include.get("system")
         version = include.get("version")
         if isinstance(system, str):
-            if system.startswith(SNOMED_AU_SYSTEM):
+            # Most includes name the AU edition exactly, so try equality first
+            if system == SNOMED_AU_SYSTEM or system.startswith(SNOMED_AU_SYSTEM):
                 return True
             if system == SNOMED_BASE_SYSTEM and isinstance(version, str):
                 if SNOMED_AU_SYSTEM in version:
@@ -177,93 +457,293 @@ def has_snomed_au_content(valueset: Mapping[str, Any]) -> bool:
 
 
 def month_end_version(date_value: dt.date) -> str:
-    last_day = calendar.monthrange(date_value.year, date_value.month)[1]
-    return f"{date_value.year:04d}{date_value.month:02d}{last_day:02d}"
+    year, month = date_value.year, date_value.month
+    last_day = 29 if month == 2 and calendar.isleap(year) else MONTH_LENGTHS[month - 1]
+    return f"{year:04d}{month:02d}{last_day:02d}"
+
+
+def parse_version_date(version: str) -> dt.date:
+    """Parse a YYYYMMDD SNOMED CT version string; raises ValueError if malformed."""
+    if len(version) != 8 or not (version.isascii() and version.isdigit()):
+        raise ValueError(f"not a YYYYMMDD version: {version!r}")
+    return dt.date(int(version[:4]), int(version[4:6]), int(version[6:]))
 
 
 def compute_versions(count: int, today: Optional[dt.date] = None) -> List[str]:
     if count <= 0:
         return []
     today = today or dt.date.today()
-    versions: List[str] = []
-    year = today.year
-    month = today.month
-    for _ in range(count):
-        date_value = dt.date(year, month, 1)
-        versions.append(month_end_version(date_value))
-        month -= 1
-        if month == 0:
-            month = 12
-            year -= 1
-    return versions
+    # Count months from year 0 so the i-th previous month is a single divmod
+    # rather than a carried year/month decrement.
+    current = today.year * 12 + today.month - 1
+    return [
+        month_end_version(dt.date(year, month + 1, 1))
+        for year, month in (divmod(current - offset, 12) for offset in range(count))
+    ]
+
+
+@lru_cache(maxsize=None)
+def quote_url(url: str) -> str:
+    """Percent-encode a valueset URL for a query string, once per distinct URL."""
+    return quote(url)
+
+
+def create_session(pool_size: int = DEFAULT_WORKERS) -> requests.Session:
+    """Create a Session whose connection pool can serve pool_size concurrent requests.
+
+    Reusing one Session keeps TCP/TLS connections to the terminology server alive
+    between $expand calls instead of handshaking for every request. Transient
+    gateway errors and dropped connections are retried with backoff so a single
+    hiccup does not leave an empty cell in the report.
+    """
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        # Batch Bundles are POSTed but only contain reads, so they are safe to retry
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ExpandCache:
+    """Persistent cache of $expand results keyed by (endpoint, valueset_url, snomed_version).
+
+    Counts are kept in a SQLite table so reruns skip the network entirely, with an
+    in-memory layer in front of it for repeated lookups within a run. Only
+    successful expansions are stored. Lookups with expires=True (used for the
+    newest release) ignore entries older than ttl_seconds. Released SNOMED
+    versions do not change, but $expand uses the server's current definition of
+    the valueset, so other lookups ignore entries older than the longer
+    history_ttl_seconds and pick up revised valuesets eventually.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: int = DEFAULT_CACHE_TTL_HOURS * 3600,
+        history_ttl_seconds: int = DEFAULT_HISTORY_CACHE_TTL_DAYS * 86400,
+    ) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.history_ttl_seconds = history_ttl_seconds
+        self._memory: Dict[Tuple[str, str, str], Tuple[int, Optional[str]]] = {}
+        self._pending: List[Tuple[str, str, str, int, Optional[str], int]] = []
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "endpoint TEXT, url TEXT, ver TEXT, count INTEGER, title TEXT, fetched_at INTEGER, "
+            "PRIMARY KEY (endpoint, url, ver))"
+        )
+        self._conn.commit()
+
+    def get(
+        self, endpoint: str, valueset_url: str, snomed_version: str, expires: bool = False
+    ) -> Optional[Tuple[int, Optional[str]]]:
+        key = (endpoint, valueset_url, snomed_version)
+        if key in self._memory:
+            return self._memory[key]
+        oldest = int(time.time()) - (self.ttl_seconds if expires else self.history_ttl_seconds)
+        row = self._conn.execute(
+            "SELECT count, title FROM cache WHERE endpoint = ? AND url = ? AND ver = ? AND fetched_at >= ?",
+            (endpoint, valueset_url, snomed_version, oldest),
+        ).fetchone()
+        if row is None:
+            return None
+        self._memory[key] = (int(row[0]), row[1])
+        return self._memory[key]
+
+    def put(self, endpoint: str, valueset_url: str, snomed_version: str, count: int, title: Optional[str]) -> None:
+        self._memory[(endpoint, valueset_url, snomed_version)] = (count, title)
+        self._pending.append((endpoint, valueset_url, snomed_version, count, title, int(time.time())))
+
+    def flush(self) -> None:
+        """Write pending entries to disk in a single transaction."""
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (endpoint, url, ver, count, title, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending = []
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+
+_shared_session: Optional[requests.Session] = None
+_shared_session_pool_size = 0
+
+
+def shared_session(pool_size: int = DEFAULT_WORKERS) -> requests.Session:
+    """Return the process-wide Session, growing its pool to at least pool_size.
+
+    Every terminology server call goes through this Session so keep-alive
+    connections are reused across validation and expansion. Call it from the
+    main thread before fanning work out to a pool.
+    """
+    global _shared_session, _shared_session_pool_size
+    if _shared_session is None or pool_size > _shared_session_pool_size:
+        if _shared_session is not None:
+            _shared_session.close()
+        _shared_session = create_session(pool_size)
+        _shared_session_pool_size = pool_size
+    return _shared_session
+
+
+def snomed_version_published(
+    endpoint: str, snomed_version: str, session: Optional[requests.Session] = None
+) -> Optional[bool]:
+    """Ask the server whether it holds a SNOMED CT AU CodeSystem for a version.
+
+    A CodeSystem search is a cheap metadata read compared to an $expand.
+    Returns True when the search finds the version, otherwise None so callers
+    can fall back: some servers do not index SNOMED CT editions as searchable
+    CodeSystems, so an empty result does not prove the version is missing.
+    """
+    if session is None:
+        session = shared_session()
+    params = {"url": SNOMED_BASE_SYSTEM, "version": f"{SNOMED_AU_SYSTEM}/version/{snomed_version}"}
+    try:
+        response = session.get(
+            endpoint.rstrip("/") + "/CodeSystem", params=params, timeout=REQUEST_TIMEOUT
+        )
+    except requests.RequestException as exc:
+        logging.warning("CodeSystem search failed for version %s: %s", snomed_version, exc)
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        bundle = json_loads(response.content)
+    except ValueError:
+        return None
+    total = parse_int(bundle.get("total"), -1)
+    found = total > 0 if total >= 0 else bool(bundle.get("entry"))
+    return True if found else None
 
 
 def validate_versions_on_server(
-    endpoint: str, valueset_index: Dict[str, Dict[str, Any]], versions: List[str]
+    endpoint: str,
+    valueset_index: Dict[str, Dict[str, Any]],
+    versions: List[str],
+    max_workers: int = DEFAULT_WORKERS,
 ) -> List[str]:
     """Validate which versions are available on the terminology server.
     
     Returns only the versions that are actually published on the server.
     Filters out versions that have not been released or pre-published.
+    Each version is checked with a CodeSystem search; if the server cannot
+    answer that, it falls back to expanding an NCTS valueset at that version.
     """
-    # Find an NCTS valueset to test with
-    for url, valueset_def in valueset_index.items():
-        if is_ncts_valueset(url):
-            # Test each version using this NCTS valueset
-            valid_versions = []
-            for version in versions:
-                count, _ = expand_valueset_count(endpoint, url, version, valueset_def)
-                if count is not None:
-                    valid_versions.append(version)
-                    logging.info("Version %s is available on terminology server", version)
-                else:
-                    logging.warning("Version %s not available on terminology server", version)
-            return valid_versions
-    
-    # No NCTS valueset found, assume all versions are valid
-    return versions
+    # Find an NCTS valueset to fall back to
+    probe = next(((url, vs) for url, vs in valueset_index.items() if is_ncts_valueset(url)), None)
+    if probe is None:
+        # No NCTS valueset found, assume all versions are valid
+        return versions
+
+    session = shared_session(max_workers)
+
+    def is_available(version: str) -> bool:
+        published = snomed_version_published(endpoint, version, session=session)
+        if published is None:
+            count, _ = expand_valueset_count(endpoint, probe[0], version, probe[1], session=session)
+            published = count is not None
+        return published
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(versions)))) as executor:
+        available = list(executor.map(is_available, versions))
+
+    valid_versions = []
+    for version, published in zip(versions, available):
+        if published:
+            valid_versions.append(version)
+            logging.debug("Version %s is available on terminology server", version)
+        else:
+            logging.warning("Version %s not available on terminology server", version)
+    return valid_versions
 
 
-def expand_valueset_count(
-    endpoint: str, valueset_url: str, snomed_version: str, valueset_def: Optional[Dict[str, Any]] = None
-) -> tuple[Optional[int], Optional[str]]:
-    """Expand a valueset and return (count, title).
-    
-    Returns a tuple of (expansion_count, valueset_title) where either can be None.
+def validate_versions_cached(
+    endpoint: str,
+    valueset_index: Dict[str, Dict[str, Any]],
+    versions: List[str],
+    cache_path: str,
+    max_workers: int = DEFAULT_WORKERS,
+) -> List[str]:
+    """validate_versions_on_server, remembering available versions for the day.
+
+    Results are stored per endpoint in a small JSON file and discarded once the
+    date changes, so reruns on the same day skip the server round trips. Only
+    versions found to be available are remembered: a version that failed its
+    check may simply have hit an outage, so it is checked again next run.
     """
-    base_url = endpoint.rstrip("/") + "/ValueSet/$expand"
+    today = dt.date.today().isoformat()
+    cached = (read_json_file(cache_path) or {}) if os.path.exists(cache_path) else {}
+    entry = cached.get(endpoint)
+    known: Dict[str, bool] = {}
+    if isinstance(entry, dict) and entry.get("date") == today and isinstance(entry.get("versions"), dict):
+        known = {str(version): True for version, available in entry["versions"].items() if available is True}
+
+    unknown = [version for version in versions if version not in known]
+    if unknown:
+        available = validate_versions_on_server(endpoint, valueset_index, unknown, max_workers)
+        known.update((version, True) for version in available)
+        cached[endpoint] = {"date": today, "versions": known}
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Write to a temporary file first so an interrupted run never leaves a truncated cache
+            with open(cache_path + ".tmp", "w", encoding="utf-8") as handle:
+                json.dump(cached, handle, indent=2)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as exc:
+            logging.warning("Could not save version cache %s: %s", cache_path, exc)
+    if len(unknown) < len(versions):
+        logging.info("Reused %d of %d version checks from today's cache", len(versions) - len(unknown), len(versions))
+
+    return [version for version in versions if version in known]
+
+
+def expand_request_path(valueset_url: str, snomed_version: str) -> str:
+    """Return the endpoint-relative $expand request for a valueset at a SNOMED CT AU version."""
     system_version = f"{SNOMED_BASE_SYSTEM}%7C{SNOMED_AU_SYSTEM}/version/{snomed_version}"
-    
-    # Build URL with encoded parameters
-    url = f"{base_url}?url={quote(valueset_url)}&system-version={system_version}&count=0&offset=0"
-    try:
-        response = requests.get(url, timeout=90)
-    except requests.RequestException as exc:
-        logging.warning("Expand request failed for %s: %s", valueset_url, exc)
-        return None, None
+    return (
+        f"ValueSet/$expand?url={quote_url(valueset_url)}"
+        f"&system-version={system_version}&count=0&offset=0"
+    )
 
-    if response.status_code != 200:
-        logging.warning(
-            "Expand failed (%s) for %s version %s", response.status_code, valueset_url, snomed_version
-        )
-        return None, None
 
-    try:
-        payload = response.json()
-    except json.JSONDecodeError:
-        logging.warning("Invalid JSON response for %s", valueset_url)
-        return None, None
+def count_from_expansion(
+    payload: Mapping[str, Any],
+    valueset_url: str,
+    snomed_version: str,
+    valueset_def: Optional[Dict[str, Any]] = None,
+    has_snomed_au: Optional[bool] = None,
+) -> Tuple[Optional[int], Optional[str]]:
+    """Extract (count, title) from an expanded ValueSet resource.
 
+    Pass has_snomed_au when it is already known to avoid re-scanning valueset_def.
+    """
     # Extract title from response
     title = payload.get("title") or payload.get("name")
     
     expansion = payload.get("expansion") or {}
     
     # Check if valueset contains SNOMED content
-    has_snomed = valueset_def and has_snomed_au_content(valueset_def)
+    if has_snomed_au is None:
+        has_snomed_au = bool(valueset_def) and has_snomed_au_content(cast(Dict[str, Any], valueset_def))
     
     # Only validate SNOMED version for valuesets that contain SNOMED codes
-    if has_snomed:
+    if has_snomed_au:
         # Check if the server used the requested SNOMED version
         # Look for SNOMED-specific used-codesystem parameters
         snomed_version_used = None
@@ -284,7 +764,8 @@ def expand_valueset_count(
             return None, None  # Return None for SNOMED version mismatches
     
     total = expansion.get("total")
-    total_value = parse_int(total, -1)
+    # Servers send total as a JSON number; only odd responses need parse_int
+    total_value = total if type(total) is int else parse_int(total, -1)
     if total_value >= 0:
         return total_value, title
     contains = expansion.get("contains")
@@ -294,70 +775,417 @@ def expand_valueset_count(
     return None, title
 
 
+def expand_valueset_count(
+    endpoint: str,
+    valueset_url: str,
+    snomed_version: str,
+    valueset_def: Optional[Dict[str, Any]] = None,
+    session: Optional[requests.Session] = None,
+    has_snomed_au: Optional[bool] = None,
+) -> tuple[Optional[int], Optional[str]]:
+    """Expand a valueset and return (count, title).
+    
+    Returns a tuple of (expansion_count, valueset_title) where either can be None.
+    Uses the shared session unless one is passed in.
+    """
+    url = endpoint.rstrip("/") + "/" + expand_request_path(valueset_url, snomed_version)
+    if session is None:
+        session = shared_session()
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as exc:
+        logging.warning("Expand request failed for %s: %s", valueset_url, exc)
+        return None, None
+
+    if response.status_code != 200:
+        logging.warning(
+            "Expand failed (%s) for %s version %s", response.status_code, valueset_url, snomed_version
+        )
+        return None, None
+
+    try:
+        payload = json_loads(response.content)
+    except ValueError:
+        logging.warning("Invalid JSON response for %s", valueset_url)
+        return None, None
+
+    return count_from_expansion(payload, valueset_url, snomed_version, valueset_def, has_snomed_au)
+
+
+def expand_valueset_counts_batch(
+    endpoint: str,
+    snomed_version: str,
+    valuesets: List[Tuple[str, Optional[Dict[str, Any]]]],
+    session: Optional[requests.Session] = None,
+    snomed_au: Optional[Mapping[str, bool]] = None,
+) -> Optional[List[Tuple[Optional[int], Optional[str]]]]:
+    """Expand several valuesets at one SNOMED CT AU version in a single FHIR batch.
+
+    valuesets is a list of (valueset_url, valueset_def) pairs. All $expand calls are
+    POSTed to the endpoint as one Bundle of type batch, and the (count, title)
+    results are returned in input order. Returns None if the batch itself fails.
+    snomed_au optionally maps valueset URLs to precomputed has_snomed_au_content results.
+    """
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [
+            {"request": {"method": "GET", "url": expand_request_path(valueset_url, snomed_version)}}
+            for valueset_url, _ in valuesets
+        ],
+    }
+    if session is None:
+        session = shared_session()
+    try:
+        response = session.post(
+            endpoint.rstrip("/"),
+            json=bundle,
+            headers={"Content-Type": "application/fhir+json", "Accept": "application/fhir+json"},
+            timeout=REQUEST_TIMEOUT,
+        )
+    except requests.RequestException as exc:
+        logging.warning("Batch expand request failed for version %s: %s", snomed_version, exc)
+        return None
+
+    if response.status_code != 200:
+        logging.warning("Batch expand failed (%s) for version %s", response.status_code, snomed_version)
+        return None
+
+    try:
+        # Batch responses carry every entry's expansion, so use the faster parser
+        payload = json_loads(response.content)
+    except ValueError:
+        logging.warning("Invalid JSON batch response for version %s", snomed_version)
+        return None
+
+    entries = payload.get("entry") if isinstance(payload, dict) else None
+    if not isinstance(entries, list) or len(entries) != len(valuesets):
+        logging.warning("Unexpected batch response for version %s", snomed_version)
+        return None
+
+    results: List[Tuple[Optional[int], Optional[str]]] = []
+    for (valueset_url, valueset_def), entry in zip(valuesets, entries):
+        entry_response = (entry.get("response") or {}) if isinstance(entry, dict) else {}
+        status = str(entry_response.get("status", ""))
+        resource = entry.get("resource") if isinstance(entry, dict) else None
+        if not status.startswith("2") or not isinstance(resource, dict):
+            logging.warning(
+                "Expand failed (%s) for %s version %s", status or "no status", valueset_url, snomed_version
+            )
+            results.append((None, None))
+            continue
+        results.append(count_from_expansion(
+            resource, valueset_url, snomed_version, valueset_def,
+            snomed_au.get(valueset_url) if snomed_au is not None else None,
+        ))
+    return results
+
+
+async def _expand_valueset_count_async(
+    session: "aiohttp.ClientSession",
+    endpoint: str,
+    valueset_url: str,
+    snomed_version: str,
+    valueset_def: Optional[Dict[str, Any]] = None,
+    has_snomed_au: Optional[bool] = None,
+) -> Tuple[Optional[int], Optional[str]]:
+    """Async counterpart of expand_valueset_count on an aiohttp session."""
+    import aiohttp  # type: ignore[import-not-found]
+
+    url = endpoint.rstrip("/") + "/" + expand_request_path(valueset_url, snomed_version)
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                logging.warning(
+                    "Expand failed (%s) for %s version %s", response.status, valueset_url, snomed_version
+                )
+                return None, None
+            body = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        logging.warning("Expand request failed for %s: %s", valueset_url, exc)
+        return None, None
+
+    try:
+        payload = json_loads(body)
+    except ValueError:
+        logging.warning("Invalid JSON response for %s", valueset_url)
+        return None, None
+
+    return count_from_expansion(payload, valueset_url, snomed_version, valueset_def, has_snomed_au)
+
+
+async def _expand_all_aiohttp(
+    endpoint: str,
+    pending: Mapping[Tuple[str, str], Optional[Dict[str, Any]]],
+    concurrency: int,
+    snomed_au: Optional[Mapping[str, bool]] = None,
+) -> Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]]:
+    import aiohttp  # type: ignore[import-not-found]
+
+    # aiohttp's total and connect timeouts include time spent queued for a free
+    # connection, so gate requests with a semaphore and time only the socket
+    # operations; otherwise queued requests time out before they are sent.
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1])
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def expand(
+        session: "aiohttp.ClientSession", valueset_url: str, version: str, valueset_def: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[int], Optional[str]]:
+        async with semaphore:
+            return await _expand_valueset_count_async(
+                session, endpoint, valueset_url, version, valueset_def,
+                snomed_au.get(valueset_url) if snomed_au is not None else None,
+            )
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        results = await asyncio.gather(
+            *(
+                expand(session, valueset_url, version, valueset_def)
+                for (valueset_url, version), valueset_def in pending.items()
+            ),
+            return_exceptions=True,
+        )
+    expansions: Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]] = {}
+    for key, result in zip(pending, results):
+        if isinstance(result, BaseException):
+            logging.warning("Expand request failed for %s: %s", key[0], result)
+            result = (None, None)
+        expansions[key] = result
+    return expansions
+
+
+async def _expand_all_http2(
+    endpoint: str,
+    pending: Mapping[Tuple[str, str], Optional[Dict[str, Any]]],
+    concurrency: int,
+    snomed_au: Optional[Mapping[str, bool]] = None,
+) -> Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]]:
+    import httpx  # type: ignore[import-not-found]
+
+    # HTTP/2 multiplexes the requests over as few connections as it needs, but
+    # httpx only negotiates it over TLS, so size the pool for plain HTTP/1.1
+    # servers too; the semaphore limits how many requests are in flight.
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    timeout = httpx.Timeout(REQUEST_TIMEOUT[1], connect=REQUEST_TIMEOUT[0])
+    semaphore = asyncio.Semaphore(concurrency)
+    base = endpoint.rstrip("/") + "/"
+
+    async def expand(
+        client: "httpx.AsyncClient", valueset_url: str, version: str, valueset_def: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[int], Optional[str]]:
+        async with semaphore:
+            try:
+                response = await client.get(base + expand_request_path(valueset_url, version))
+            except httpx.HTTPError as exc:
+                logging.warning("Expand request failed for %s: %s", valueset_url, exc)
+                return None, None
+        if response.status_code != 200:
+            logging.warning("Expand failed (%s) for %s version %s", response.status_code, valueset_url, version)
+            return None, None
+        try:
+            payload = json_loads(response.content)
+        except ValueError:
+            logging.warning("Invalid JSON response for %s", valueset_url)
+            return None, None
+        return count_from_expansion(
+            payload, valueset_url, version, valueset_def,
+            snomed_au.get(valueset_url) if snomed_au is not None else None,
+        )
+
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=timeout) as client:
+        results = await asyncio.gather(
+            *(
+                expand(client, valueset_url, version, valueset_def)
+                for (valueset_url, version), valueset_def in pending.items()
+            ),
+            return_exceptions=True,
+        )
+    expansions: Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]] = {}
+    for key, result in zip(pending, results):
+        if isinstance(result, BaseException):
+            logging.warning("Expand request failed for %s: %s", key[0], result)
+            result = (None, None)
+        expansions[key] = result
+    return expansions
+
+
+def expand_valueset_counts_async(
+    endpoint: str,
+    pending: Mapping[Tuple[str, str], Optional[Dict[str, Any]]],
+    concurrency: int = DEFAULT_WORKERS,
+    snomed_au: Optional[Mapping[str, bool]] = None,
+) -> Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]]:
+    """Expand many (valueset_url, version) pairs concurrently on one event loop.
+
+    pending maps each pair to its valueset definition. Uses httpx over HTTP/2
+    when httpx and h2 are installed, otherwise aiohttp; either way at most
+    concurrency requests are in flight.
+    """
+    driver = _expand_all_http2 if HTTP2_AVAILABLE else _expand_all_aiohttp
+    return asyncio.run(driver(endpoint, pending, max(1, concurrency), snomed_au))
+
+
 def build_rows(
-    deduped: List[Dict[str, str]],
+    deduped: List[Binding],
     valueset_index: Dict[str, Dict[str, Any]],
     versions: List[str],
     endpoint: str,
     expand_func=expand_valueset_count,
+    max_workers: int = DEFAULT_WORKERS,
+    cache: Optional[ExpandCache] = None,
+    batch: bool = False,
+    use_async: bool = False,
 ) -> List[Dict[str, object]]:
-    rows: List[Dict[str, object]] = []
-    for item in deduped:
-        valueset_url = item.get("valueset_url", "")
-        ncts = is_ncts_valueset(valueset_url)
-        
+    # One row per NCTS valueset URL, collecting the StructureDefinitions that
+    # bind it in the same pass. Non-NCTS URLs map to None so they are only
+    # checked once, and SNOMED CT AU content is detected once per valueset
+    # rather than for every version expanded.
+    grouped: Dict[str, Optional[Tuple[Dict[str, object], Dict[str, Any], List[Tuple[str, str]]]]] = {}
+    snomed_au: Dict[str, bool] = {}
+    for valueset_url, sd_url, sd_name in deduped:
+        if valueset_url not in grouped:
+            if is_ncts_valueset(valueset_url):
+                valueset = valueset_index.get(valueset_url) or {}
+                row: Dict[str, object] = {
+                    "valueset_url": valueset_url,
+                    "valueset_name": valueset.get("name") or valueset.get("title") or "",
+                }
+                grouped[valueset_url] = (row, valueset, [])
+                snomed_au[valueset_url] = bool(valueset) and has_snomed_au_content(valueset)
+            else:
+                grouped[valueset_url] = None
+        group = grouped[valueset_url]
+
         # Skip non-NCTS valuesets entirely
-        if not ncts:
+        if group is None:
             continue
-            
-        valueset = valueset_index.get(valueset_url) or {}
-        valueset_name = valueset.get("name") or valueset.get("title") or ""
-
-        row: Dict[str, object] = {
-            "valueset_url": valueset_url,
-            "valueset_name": valueset_name,
-            "structure_definition_url": item.get("structure_definition_url", ""),
-            "structure_definition_name": item.get("structure_definition_name", ""),
-        }
-
-        # Expand NCTS valuesets
-        if versions:
-            for version in versions:
-                count, api_title = expand_func(endpoint, valueset_url, version, valueset)
-                # Use title from API if not already set from local definition
-                if valueset_name == "" and api_title:
-                    valueset_name = api_title
-                    row["valueset_name"] = valueset_name
-                row[version] = "" if count is None else count
-        rows.append(row)
-    
-    # Group rows by valueset_url, combining structure definitions
-    grouped: Dict[str, Dict[str, object]] = {}
+
+        if sd_name or sd_url:
+            group[2].append((sd_name, sd_url))
+
+    groups = [group for group in grouped.values() if group is not None]
+    rows = [row for row, _, _ in groups]
+    valueset_defs = [valueset for _, valueset, _ in groups]
+
+    # Expand NCTS valuesets: every (valueset, version) pair is an independent
+    # network-bound request, so fan the uncached ones out over a thread pool
+    # that shares one pooled session. Rows are already one per valueset URL, so
+    # each (url, version) pair is expanded once.
+    expansions: Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]] = {}
+    pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    # Only the newest release may still change on the server
+    newest_version = max(versions) if versions else None
+    for row, valueset in zip(rows, valueset_defs):
+        valueset_url = str(row["valueset_url"])
+        for version in versions:
+            key = (valueset_url, version)
+            cached = (
+                cache.get(endpoint, valueset_url, version, expires=version == newest_version)
+                if cache is not None else None
+            )
+            if cached is None:
+                pending[key] = valueset
+            else:
+                expansions[key] = cached
+    if cache is not None:
+        logging.info(
+            "Reused %d of %d expansions from cache", len(expansions), len(expansions) + len(pending)
+        )
+
+    if pending and use_async and not batch and expand_func is expand_valueset_count:
+        if HTTP2_AVAILABLE or AIOHTTP_AVAILABLE:
+            for key, result in expand_valueset_counts_async(endpoint, pending, max_workers, snomed_au).items():
+                expansions[key] = result
+                count, api_title = result
+                if cache is not None and count is not None:
+                    cache.put(endpoint, key[0], key[1], count, api_title)
+            pending = {}
+        else:
+            logging.warning("Neither httpx nor aiohttp is installed; expanding valuesets with the thread pool")
+
+    if pending:
+        session = shared_session(max_workers)
+        # Custom hooks keep the (endpoint, url, version, valueset) signature;
+        # only the built-in expander is handed the pooled session and the
+        # precomputed SNOMED CT AU flag
+        builtin_expand = expand_func is expand_valueset_count
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+
+            def submit_each(
+                items: Iterable[Tuple[Tuple[str, str], Dict[str, Any]]],
+            ) -> Dict[Any, Tuple[str, str]]:
+                return {
+                    executor.submit(
+                        expand_func, endpoint, valueset_url, version, valueset,
+                        **({"session": session, "has_snomed_au": snomed_au[valueset_url]} if builtin_expand else {}),
+                    ): (valueset_url, version)
+                    for (valueset_url, version), valueset in items
+                }
+
+            def collect_batches() -> Iterator[Tuple[Tuple[str, str], Tuple[Optional[int], Optional[str]]]]:
+                # Batch Bundles of up to BATCH_SIZE entries per version instead of
+                # one request per pair; the chunks are expanded in parallel
+                by_version: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+                for (valueset_url, version), valueset in pending.items():
+                    by_version.setdefault(version, []).append((valueset_url, valueset))
+                batch_futures = {
+                    executor.submit(
+                        expand_valueset_counts_batch,
+                        endpoint, version, cast(List[Tuple[str, Optional[Dict[str, Any]]]], chunk),
+                        session=session, snomed_au=snomed_au,
+                    ): (version, chunk)
+                    for version, valuesets in by_version.items()
+                    for chunk in (valuesets[i:i + BATCH_SIZE] for i in range(0, len(valuesets), BATCH_SIZE))
+                }
+                fallback: Dict[Any, Tuple[str, str]] = {}
+                for future in as_completed(batch_futures):
+                    version, chunk = batch_futures[future]
+                    batch_results = future.result()
+                    if batch_results is None:
+                        # The server refused or mangled the batch; expand its entries one by one
+                        logging.warning("Falling back to individual expands for version %s", version)
+                        fallback.update(submit_each(
+                            ((valueset_url, version), valueset) for valueset_url, valueset in chunk
+                        ))
+                        continue
+                    for (valueset_url, _), result in zip(chunk, batch_results):
+                        yield (valueset_url, version), result
+                for future in as_completed(fallback):
+                    yield fallback[future], future.result()
+
+            # Batch Bundles bypass expand_func, so only use them for the built-in expander
+            if batch and builtin_expand:
+                completed = collect_batches()
+            else:
+                future_keys = submit_each(pending.items())
+                completed = ((future_keys[future], future.result()) for future in as_completed(future_keys))
+
+            # Collect results as they finish; only this thread touches the cache
+            for key, result in completed:
+                expansions[key] = result
+                count, api_title = result
+                if cache is not None and count is not None:
+                    cache.put(endpoint, key[0], key[1], count, api_title)
+    if cache is not None:
+        cache.flush()
+
+    # Fill versions in order so the first API title seen for a row matches the
+    # sequential behaviour.
     for row in rows:
         valueset_url = str(row["valueset_url"])
-        if valueset_url not in grouped:
-            grouped[valueset_url] = row
-            grouped[valueset_url]["structure_definitions"] = []
-        
-        # Collect structure definitions
-        sd_name = cast(str, row.get("structure_definition_name", ""))
-        sd_url = cast(str, row.get("structure_definition_url", ""))
-        if sd_name or sd_url:
-            sd_list = cast(List[Tuple[str, str]], grouped[valueset_url]["structure_definitions"])
-            sd_list.append((sd_name, sd_url))
-    
-    # Convert grouped data back to list format
-    result: List[Dict[str, object]] = []
-    for valueset_url, row in grouped.items():
-        sds = cast(List[Tuple[str, str]], row.pop("structure_definitions", []))
-        # Keep structure definitions as list of tuples for flexible formatting
+        for version in versions:
+            count, api_title = expansions[(valueset_url, version)]
+            # Use title from API if not already set from local definition
+            if row["valueset_name"] == "" and api_title:
+                row["valueset_name"] = api_title
+            row[version] = "" if count is None else count
+    
+    # Keep structure definitions as list of tuples for flexible formatting
+    for row, _, sds in groups:
         row["structure_definitions"] = sds
-        # Remove individual structure definition columns
-        row.pop("structure_definition_url", None)
-        row.pop("structure_definition_name", None)
-        result.append(row)
-    
-    return result
+
+    return rows
 
 def is_change_significant(base_value, new_value):
     """
@@ -367,19 +1195,38 @@ def is_change_significant(base_value, new_value):
     # Calculate the absolute difference
     difference = abs(new_value - base_value)
     
-    # The constants derived from your points (500, 25) and (60,000, 500)
-    # This creates a curve where the % required drops as the number grows.
-    exponent = 0.6257
-    coefficient = 0.5118
-    
     # Calculate the dynamic threshold for this specific base value
-    threshold = coefficient * (base_value ** exponent)
+    threshold = SIGNIFICANCE_COEFFICIENT * (base_value ** SIGNIFICANCE_EXPONENT)
     
     return difference >= threshold, round(threshold, 2)
 
+def iter_tsv_records(
+    rows: Iterable[Mapping[str, object]], version_columns: List[str]
+) -> Iterator[Tuple[object, ...]]:
+    """Yield one TSV record per row, with fields in output header order."""
+    for row in rows:
+        # Format structure definitions as text for TSV
+        sds = row.get("structure_definitions", [])
+        if isinstance(sds, list):
+            sd_text = ", ".join(
+                f"{name} ({url})" if name and url else (name or url)
+                for name, url in cast(List[Tuple[str, str]], sds)
+            )
+        else:
+            sd_text = str(sds) if sds else ""
+        
+        yield (
+            row.get("valueset_name", ""),
+            row.get("valueset_url", ""),
+            sd_text,
+            *(row.get(version, "") for version in version_columns),
+        )
+
+
 def write_tsv(
-    rows: List[Dict[str, object]], output_path: str, version_columns: List[str]
+    rows: Iterable[Mapping[str, object]], output_path: str, version_columns: List[str]
 ) -> None:
+    """Write rows as TSV, formatting each record only as the writer consumes it."""
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     headers = [
         "ValueSet Name",
@@ -387,29 +1234,12 @@ def write_tsv(
         "Structure Definitions",
     ] + version_columns
 
-    with open(output_path, "w", encoding="utf-8", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=headers, delimiter="\t")
-        writer.writeheader()
-        for row in rows:
-            # Format structure definitions as text for TSV
-            sds = row.get("structure_definitions", [])
-            if isinstance(sds, list):
-                sd_text = ", ".join(
-                    f"{name} ({url})" if name and url else (name or url)
-                    for name, url in cast(List[Tuple[str, str]], sds)
-                )
-            else:
-                sd_text = str(sds) if sds else ""
-            
-            # Map old keys to new header names for output
-            output_row = {
-                "ValueSet Name": row.get("valueset_name", ""),
-                "ValueSet URL": row.get("valueset_url", ""),
-                "Structure Definitions": sd_text,
-            }
-            for version in version_columns:
-                output_row[version] = row.get(version, "")
-            writer.writerow(output_row)
+    with open(output_path, "w", encoding="utf-8", newline="", buffering=OUTPUT_BUFFER_SIZE) as handle:
+        # A plain writer with positional records skips DictWriter's per-row
+        # key lookups and field checks
+        writer = csv.writer(handle, delimiter="\t")
+        writer.writerow(headers)
+        writer.writerows(iter_tsv_records(rows, version_columns))
 
 
 def read_tsv_data(tsv_path: str) -> Tuple[List[Dict[str, object]], List[str]]:
@@ -473,37 +1303,37 @@ def get_trending_status(row: Dict[str, object], version_columns: List[str]) -> D
     
     Example: 20250531=508, 20250630=353 -> highlight 353 (the drop at 20250630)
     """
-    trending = {}
+    trending = dict.fromkeys(version_columns, "")
     
-    # First, initialize all cells as not trending
+    # Convert each version's count once; None marks a missing or unparsable value
+    counts: List[Optional[int]] = []
     for version in version_columns:
-        trending[version] = ""
-    
-    # Now check for drops: if a newer version (lower index) is lower than older (higher index)
-    for i in range(len(version_columns) - 1):
-        current_version = version_columns[i]  # Newer version
-        next_older_version = version_columns[i + 1]  # Older version
-        
-        current_val = row.get(current_version)
-        next_val = row.get(next_older_version)
-        
-        if current_val == "" or current_val is None or next_val == "" or next_val is None:
-            continue
-        
+        value = row.get(version)
         try:
-            current_int = int(cast(Any, current_val))
-            next_int = int(cast(Any, next_val))
-            # If newer value is less than older value AND the change is significant, highlight
-            if current_int < next_int:
-                is_significant, threshold = is_change_significant(next_int, current_int)
-                if is_significant:
-                    trending[current_version] = "trending-down"
+            counts.append(None if value == "" or value is None else int(cast(Any, value)))
         except (ValueError, TypeError):
-            continue
+            counts.append(None)
+    
+    # Now check for drops: if a newer version (lower index) is lower than older (higher index)
+    for i in range(len(counts) - 1):
+        current_int = counts[i]  # Newer version
+        next_int = counts[i + 1]  # Older version
+        # If newer value is less than older value AND the change is significant, highlight
+        if current_int is not None and next_int is not None and current_int < next_int:
+            is_significant, _ = is_change_significant(next_int, current_int)
+            if is_significant:
+                trending[version_columns[i]] = "trending-down"
     
     return trending
 
 
+def format_structure_definition_link(name: str, url: str) -> str:
+    """Render one StructureDefinition as an HTML link, escaping name and URL."""
+    if url:
+        return f"<a href='{html.escape(url)}'>{html.escape(name) if name else 'Link'}</a>"
+    return html.escape(name)
+
+
 def write_html(
     rows: List[Dict[str, object]], output_path: str, version_columns: List[str],
     terminology_server: str = "", versions_to_compare: int = 0, config_igs: Optional[List[Dict[str, Any]]] = None
@@ -530,7 +1360,7 @@ def write_html(
         "Structure Definitions": "structure_definitions",
     }
     
-    html_content = [
+    preamble = [
         "<!DOCTYPE html>",
         "<html>",
         "<head>",
@@ -557,51 +1387,7 @@ def write_html(
         "<table>",
     ]
     
-    # Write header row
-    html_content.append("<tr>")
-    for header in headers:
-        if header in version_columns:
-            html_content.append(f"<th class='version-col'>{header}</th>")
-        else:
-            html_content.append(f"<th>{header}</th>")
-    html_content.append("</tr>")
-    
-    # Write data rows
-    for row in rows:
-        trending = get_trending_status(row, version_columns)
-        html_content.append("<tr>")
-        
-        for header in headers:
-            # Get the value using the mapping
-            if header in header_mapping:
-                key = header_mapping[header]
-                value = row.get(key, "")
-                
-                # Format structure definitions as HTML links
-                if key == "structure_definitions" and isinstance(value, list):
-                    links = ", ".join(
-                        f"<a href='{url}'>{name}</a>" if url and name else (f"<a href='{url}'>Link</a>" if url else name)
-                        for name, url in cast(List[Tuple[str, str]], value)
-                    )
-                    html_content.append(f"<td>{links}</td>")
-                    continue
-            else:
-                value = row.get(header, "")
-            
-            is_version_col = header in reversed_version_columns
-            
-            if is_version_col and trending.get(header) == "trending-down":
-                html_content.append(
-                    f"<td class='trending-down version-col'>{value}</td>"
-                )
-            elif is_version_col:
-                html_content.append(f"<td class='version-col'>{value}</td>")
-            else:
-                html_content.append(f"<td>{value}</td>")
-        
-        html_content.append("</tr>")
-    
-    html_content.extend([
+    epilogue = [
         "</table>",
         "<p style='margin-top: 20px; font-size: 12px;'>",
         "<strong>Legend:</strong> Cells highlighted in red indicate a decrease in expansion count from the previous version.",
@@ -610,10 +1396,59 @@ def write_html(
         "</div>",
         "</body>",
         "</html>",
-    ])
+    ]
     
-    with open(output_path, "w", encoding="utf-8") as handle:
-        handle.write("\n".join(html_content))
+    def text_cell(key: str) -> Callable[[Mapping[str, object], Mapping[str, str]], str]:
+        return lambda row, trending: f"<td>{html.escape(str(row.get(key, '')))}</td>"
+
+    def version_cell(version: str) -> Callable[[Mapping[str, object], Mapping[str, str]], str]:
+        def emit(row: Mapping[str, object], trending: Mapping[str, str]) -> str:
+            if trending.get(version) == "trending-down":
+                return f"<td class='trending-down version-col'>{row.get(version, '')}</td>"
+            return f"<td class='version-col'>{row.get(version, '')}</td>"
+        return emit
+
+    def structure_definitions_cell(row: Mapping[str, object], trending: Mapping[str, str]) -> str:
+        value = row.get("structure_definitions", "")
+        # Format structure definitions as HTML links
+        if isinstance(value, list):
+            links = ", ".join(
+                format_structure_definition_link(name, url)
+                for name, url in cast(List[Tuple[str, str]], value)
+            )
+            return f"<td>{links}</td>"
+        return f"<td>{html.escape(str(value))}</td>"
+
+    emitters: List[Callable[[Mapping[str, object], Mapping[str, str]], str]] = []
+    for header in headers:
+        key = header_mapping.get(header, header)
+        if key == "structure_definitions":
+            emitters.append(structure_definitions_cell)
+        elif header in reversed_version_columns:
+            emitters.append(version_cell(header))
+        else:
+            emitters.append(text_cell(key))
+
+    with open(output_path, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE) as handle:
+        write = handle.write
+        write("\n".join(preamble))
+        write("\n")
+
+        # Write header row
+        write("<tr>")
+        write("".join(
+            f"<th class='version-col'>{header}</th>" if header in version_columns else f"<th>{header}</th>"
+            for header in headers
+        ))
+        write("</tr>\n")
+
+        # Write data rows, one string per row, using a cell emitter per
+        # column so the header checks happen once rather than for every cell
+        for row in rows:
+            trending = get_trending_status(row, version_columns)
+            write(f"<tr>{''.join(emit(row, trending) for emit in emitters)}</tr>\n")
+
+        write("\n".join(epilogue))
 
 
 def write_chart_html(
@@ -747,26 +1582,24 @@ def _generate_single_chart(
     y_min = max(0, min_val - y_range * 0.1)  # 10% padding below
     y_max = max_val + y_range * 0.1  # 10% padding above
     
+    # Parts of the scales that are the same for every point
+    y_span = y_max - y_min
+    y_bottom = margin_top + chart_height
+    x_right = margin_left + chart_width
+    x_steps = len(reversed_versions) - 1
+    
     def y_scale(value):
         """Scale value to Y coordinate (linear scale)"""
-        if value is None or y_max == y_min:
+        if value is None or y_span == 0:
             return None
-        ratio = (value - y_min) / (y_max - y_min)
-        return margin_top + chart_height - (ratio * chart_height)
+        return y_bottom - ((value - y_min) / y_span * chart_height)
     
     def x_scale(index):
         """Scale index to X coordinate"""
-        return margin_left + (index * chart_width / (len(reversed_versions) - 1))
-    
-    # Generate color palette
-    def get_color(index):
-        colors = ['#e41a1c', '#377eb8', '#1D7DB3', '#984ea3', '#ff7f00', 
-                  '#ffff33', '#a65628', '#f781bf', '#999999', '#66c2a5',
-                  '#fc8d62', '#8da0cb', '#e78ac3', '#a6d854', '#ffd92f']
-        return colors[index % len(colors)]
+        return margin_left + (index * chart_width / x_steps)
     
     # Build SVG content
-    svg_lines = []
+    svg_lines = [CHART_POINT_SYMBOL]
     
     # Draw Y-axis grid lines and labels (5-7 lines)
     num_gridlines = 6
@@ -774,58 +1607,65 @@ def _generate_single_chart(
         value = y_min + (y_max - y_min) * i / num_gridlines
         y = y_scale(value)
         if y is not None:
-            svg_lines.append(f'<line x1="{margin_left}" y1="{y}" x2="{margin_left + chart_width}" y2="{y}" stroke="#e0e0e0" stroke-width="1"/>')
+            svg_lines.append(f'<line x1="{margin_left}" y1="{y}" x2="{x_right}" y2="{y}" stroke="#e0e0e0" stroke-width="1"/>')
             svg_lines.append(f'<text x="{margin_left - 10}" y="{y + 5}" text-anchor="end" font-size="12" fill="#666">{int(value):,}</text>')
     
     # Draw X-axis labels
+    x_label_y = y_bottom + 30
     for i, version in enumerate(reversed_versions):
         x = x_scale(i)
-        svg_lines.append(f'<text x="{x}" y="{margin_top + chart_height + 30}" text-anchor="middle" font-size="11" fill="#666">{version}</text>')
+        svg_lines.append(f'<text x="{x}" y="{x_label_y}" text-anchor="middle" font-size="11" fill="#666">{version}</text>')
     
     # Draw axes
     svg_lines.append(f'<line x1="{margin_left}" y1="{margin_top}" x2="{margin_left}" y2="{margin_top + chart_height}" stroke="#333" stroke-width="2"/>')
     svg_lines.append(f'<line x1="{margin_left}" y1="{margin_top + chart_height}" x2="{margin_left + chart_width}" y2="{margin_top + chart_height}" stroke="#333" stroke-width="2"/>')
     
-    # Draw lines for each valueset
+    # Draw lines for each valueset; every series shares the same x positions
+    xs = [x_scale(i) for i in range(len(reversed_versions))]
     legend_items = []
     for idx, series in enumerate(chart_data):
-        color = get_color(idx)
-        points = []
-        for i, value in enumerate(series["values"]):
-            y = y_scale(value)
-            if y is not None:
-                x = x_scale(i)
-                points.append(f"{x},{y}")
+        color = CHART_COLORS[idx % len(CHART_COLORS)]
+        # Scale each value once and reuse it for both the line and its points
+        points = [
+            (x, y, value)
+            for x, y, value in zip(xs, map(y_scale, series["values"]), series["values"])
+            if y is not None
+        ]
         
         if points:
             # Add line with tooltip showing valueset name
-            svg_lines.append(f'<polyline points="{" ".join(points)}" fill="none" stroke="{color}" stroke-width="2"><title>{series["name"]}</title></polyline>')
+            polyline = " ".join([f"{x},{y}" for x, y, _ in points])
+            svg_lines.append(f'<polyline points="{polyline}" fill="none" stroke="{color}" stroke-width="2"><title>{series["name"]}</title></polyline>')
             
             # Add points with tooltips showing count
-            for i, value in enumerate(series["values"]):
-                y = y_scale(value)
-                if y is not None:
-                    x = x_scale(i)
-                    version = reversed_versions[i]
-                    # Create circle with tooltip showing count
-                    svg_lines.append(f'<circle cx="{x}" cy="{y}" r="4" fill="{color}"><title>{int(value):,}</title></circle>')
+            svg_lines.extend([
+                CHART_POINT_TEMPLATE.format(x=x, y=y, color=color, count=int(value))
+                for x, y, value in points
+            ])
             
             legend_items.append((color, series["name"]))
     
-    # Create legend
-    legend_y = margin_top
-    for color, name in legend_items:
-        svg_lines.append(f'<line x1="{margin_left + chart_width + 20}" y1="{legend_y}" x2="{margin_left + chart_width + 50}" y2="{legend_y}" stroke="{color}" stroke-width="2"/>')
-        svg_lines.append(f'<text x="{margin_left + chart_width + 55}" y="{legend_y + 4}" font-size="11" fill="#333">{name[:35]}</text>')
-        legend_y += 20
+    # Create legend: one template per entry with the x positions filled in
+    # once, and the rows stacked 20px apart
+    legend_x1, legend_x2, legend_text_x = x_right + 20, x_right + 50, x_right + 55
+    legend_template = (
+        f'<line x1="{legend_x1}" y1="{{y}}" x2="{legend_x2}" y2="{{y}}" stroke="{{color}}" stroke-width="2"/>\n'
+        f'<text x="{legend_text_x}" y="{{text_y}}" font-size="11" fill="#333">{{name}}</text>'
+    )
+    legend_ys = range(margin_top, margin_top + 20 * len(legend_items), 20)
+    svg_lines.extend([
+        legend_template.format(y=legend_y, text_y=legend_y + 4, color=color, name=name[:35])
+        for (color, name), legend_y in zip(legend_items, legend_ys)
+    ])
     
     # Axis titles
     svg_lines.append(f'<text x="{margin_left + chart_width / 2}" y="{margin_top + chart_height + 60}" text-anchor="middle" font-size="14" font-weight="bold" fill="#333">Release (Oldest to Newest)</text>')
     svg_lines.append(f'<text x="{margin_left - 60}" y="{margin_top + chart_height / 2}" text-anchor="middle" font-size="14" font-weight="bold" fill="#333" transform="rotate(-90, {margin_left - 60}, {margin_top + chart_height / 2})">Count of Elements</text>')
     svg_lines.append(f'<text x="{width / 2}" y="{margin_top - 20}" text-anchor="middle" font-size="18" font-weight="bold" fill="#333">{title}</text>')
     
-    # Generate HTML
-    html_content = f"""<!DOCTYPE html>
+    # Generate HTML around the SVG; the SVG lines are written straight to the
+    # file rather than joined into one document string
+    html_head = f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset='UTF-8'>
@@ -865,14 +1705,15 @@ def _generate_single_chart(
             opacity: 1;
         }}
         polyline {{ cursor: pointer; }}
-        circle {{ cursor: pointer; }}
+        use {{ cursor: pointer; }}
     </style>
 </head>
 <body>
     <div class="tooltip" id="tooltip"></div>
     <div class="container">
         <svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg" id="chart-svg">
-            {chr(10).join(svg_lines)}
+            """
+    html_tail = f"""
         </svg>
         <p style="text-align: center; color: #666; font-size: 12px;">
             Showing trends for {len(chart_data)} NCTS valuesets across {len(reversed_versions)} releases
@@ -882,54 +1723,37 @@ def _generate_single_chart(
         const tooltip = document.getElementById('tooltip');
         const svg = document.getElementById('chart-svg');
         
-        // Add hover events to all polylines (lines)
-        const polylines = svg.querySelectorAll('polyline');
-        polylines.forEach(polyline => {{
-            polyline.addEventListener('mouseover', (e) => {{
-                const title = polyline.querySelector('title');
-                if (title) {{
-                    tooltip.textContent = title.textContent;
-                    tooltip.classList.add('visible');
-                }}
-            }});
-            
-            polyline.addEventListener('mousemove', (e) => {{
-                tooltip.style.left = (e.clientX + 15) + 'px';
-                tooltip.style.top = (e.clientY - 15) + 'px';
-            }});
-            
-            polyline.addEventListener('mouseout', () => {{
-                tooltip.classList.remove('visible');
-            }});
+        // One set of listeners on the SVG serves every line and data point
+        const isDataElement = (el) => el.tagName === 'polyline' || el.tagName === 'use';
+        
+        svg.addEventListener('mouseover', (e) => {{
+            if (!isDataElement(e.target)) return;
+            const title = e.target.querySelector('title');
+            if (title) {{
+                tooltip.textContent = title.textContent;
+                tooltip.classList.add('visible');
+            }}
         }});
         
-        // Add hover events to all circles (data points)
-        const circles = svg.querySelectorAll('circle');
-        circles.forEach(circle => {{
-            circle.addEventListener('mouseover', (e) => {{
-                const title = circle.querySelector('title');
-                if (title) {{
-                    tooltip.textContent = title.textContent;
-                    tooltip.classList.add('visible');
-                }}
-            }});
-            
-            circle.addEventListener('mousemove', (e) => {{
-                tooltip.style.left = (e.clientX + 15) + 'px';
-                tooltip.style.top = (e.clientY - 15) + 'px';
-            }});
-            
-            circle.addEventListener('mouseout', () => {{
-                tooltip.classList.remove('visible');
-            }});
+        svg.addEventListener('mousemove', (e) => {{
+            if (!isDataElement(e.target)) return;
+            tooltip.style.left = (e.clientX + 15) + 'px';
+            tooltip.style.top = (e.clientY - 15) + 'px';
+        }});
+        
+        svg.addEventListener('mouseout', (e) => {{
+            if (isDataElement(e.target)) tooltip.classList.remove('visible');
         }});
     </script>
 </body>
 </html>"""
     
     try:
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
+        with open(output_path, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE) as f:
+            f.write(html_head)
+            f.write(svg_lines[0] if svg_lines else "")
+            f.writelines("\n" + line for line in svg_lines[1:])
+            f.write(html_tail)
     except Exception as exc:
         logging.warning("Failed to create chart HTML: %s", exc)
 
@@ -1099,15 +1923,15 @@ def create_web_folder(
         </div>
         
         <div id="chart-low" class="tab-content">
-            <iframe src="{chart_low_filename}" title="Low Count Chart"></iframe>
+            <iframe data-src="{chart_low_filename}" title="Low Count Chart"></iframe>
         </div>
         
         <div id="chart-medium" class="tab-content">
-            <iframe src="{chart_medium_filename}" title="Medium Count Chart"></iframe>
+            <iframe data-src="{chart_medium_filename}" title="Medium Count Chart"></iframe>
         </div>
         
         <div id="chart-high" class="tab-content">
-            <iframe src="{chart_high_filename}" title="High Count Chart"></iframe>
+            <iframe data-src="{chart_high_filename}" title="High Count Chart"></iframe>
         </div>
         
         <div class="footer">
@@ -1131,8 +1955,15 @@ def create_web_folder(
             }}
             
             // Show the selected tab and mark button as active
-            document.getElementById(tabName).classList.add("active");
+            var tab = document.getElementById(tabName);
+            tab.classList.add("active");
             evt.currentTarget.classList.add("active");
+            
+            // Chart documents are only loaded the first time their tab is shown
+            var frame = tab.querySelector("iframe[data-src]");
+            if (frame && !frame.getAttribute("src")) {{
+                frame.src = frame.dataset.src;
+            }}
         }}
     </script>
 </body>
@@ -1149,6 +1980,33 @@ def create_web_folder(
     return web_folder
 
 
+def write_reports(
+    rows: List[Dict[str, object]], versions: List[str], output_path: str, html_output_path: str,
+    data_folder: str, endpoint: str, versions_to_compare: int, igs: List[Dict[str, Any]],
+    action: str = "Wrote",
+) -> None:
+    """Write the HTML report, the three charts and the web folder for rows."""
+    write_html(rows, html_output_path, versions, endpoint, versions_to_compare, igs)
+
+    # Create HTML charts (3 separate charts by count range)
+    chart_output_path = output_path.replace(".tsv", "-chart.html")
+    chart_low_path, chart_medium_path, chart_high_path = write_chart_html(rows, chart_output_path, versions)
+
+    logging.info("%s %s", action, html_output_path)
+    logging.info("%s %s", action, chart_low_path)
+    logging.info("%s %s", action, chart_medium_path)
+    logging.info("%s %s", action, chart_high_path)
+
+    # Create web-ready folder with index.html
+    web_folder = create_web_folder(data_folder, html_output_path,
+                                   chart_low_path, chart_medium_path, chart_high_path,
+                                   endpoint, versions_to_compare, igs)
+    logging.info("Created web folder: %s", web_folder)
+    print(f"\n✓ Web folder ready for deployment: {web_folder}")
+    print(f"  - Upload the contents of this folder to your web host")
+    print(f"  - Open index.html in a browser to view the dashboard")
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(
         description=(
@@ -1180,6 +2038,13 @@ def main() -> int:
         "--sctver",
         help="Latest SNOMED CT AU version (YYYYMMDD format). Versions newer than this will be filtered out. If not specified, versions more than 7 days in the future will be removed.",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=(
+            "Ignore the on-disk caches: rescan every package and query the terminology server for every count."
+        ),
+    )
     args = parser.parse_args()
 
     config_path = expand_user(args.config)
@@ -1191,6 +2056,13 @@ def main() -> int:
     output_filename = str(config.get("output_filename", "vs-diff.tsv"))
     data_folder = expand_user(str(config.get("data_folder", "~/data/vs-differ")))
     dev_mode = config.get("dev", False)
+    max_workers = parse_int(
+        os.environ.get(WORKERS_ENV_VAR), parse_int(config.get("max_workers"), DEFAULT_WORKERS)
+    )
+    cache_ttl_hours = parse_int(config.get("cache_ttl_hours"), DEFAULT_CACHE_TTL_HOURS)
+    history_cache_ttl_days = parse_int(config.get("history_cache_ttl_days"), DEFAULT_HISTORY_CACHE_TTL_DAYS)
+    batch_expand = bool(config.get("batch_expand", False))
+    async_expand = bool(config.get("async_expand", False))
 
     output_path = os.path.join(data_folder, output_filename)
     html_output_path = output_path.replace(".tsv", ".html")
@@ -1200,7 +2072,8 @@ def main() -> int:
     logging.basicConfig(
         level=logging.INFO,
         format="%(levelname)s: %(message)s",
-        filename=log_file,
+        # delay=True leaves the file unopened until the first record is logged
+        handlers=[logging.FileHandler(log_file, delay=True)],
     )
 
     # Determine which IGs to process
@@ -1226,32 +2099,20 @@ def main() -> int:
         
         # Skip the version filtering since TSV already has the right versions
         # Just regenerate HTML and charts from the TSV data
-        write_html(rows, html_output_path, versions, endpoint, versions_to_compare, igs)
-        
-        # Create HTML charts
-        chart_output_path = output_path.replace(".tsv", "-chart.html")
-        chart_low_path, chart_medium_path, chart_high_path = write_chart_html(rows, chart_output_path, versions)
-        
-        logging.info("Regenerated %s", html_output_path)
-        logging.info("Regenerated %s", chart_low_path)
-        logging.info("Regenerated %s", chart_medium_path)
-        logging.info("Regenerated %s", chart_high_path)
-        
-        # Create web-ready folder with index.html
-        web_folder = create_web_folder(data_folder, html_output_path, 
-                                       chart_low_path, chart_medium_path, chart_high_path,
-                                       endpoint, versions_to_compare, igs)
-        logging.info("Created web folder: %s", web_folder)
-        print(f"\n✓ Web folder ready for deployment: {web_folder}")
-        print(f"  - Upload the contents of this folder to your web host")
-        print(f"  - Open index.html in a browser to view the dashboard")
-        
+        write_reports(
+            rows, versions, output_path, html_output_path, data_folder,
+            endpoint, versions_to_compare, igs, action="Regenerated",
+        )
         return 0
 
-    bound_valuesets: List[Dict[str, str]] = []
+    # Bindings keyed by (valueset_url, structure_definition_url) so duplicates
+    # are dropped as they are collected; dicts preserve first-seen order.
+    bound_valuesets: Dict[Tuple[str, str], Binding] = {}
     valueset_index: Dict[str, Dict[str, Any]] = {}
 
-    # Process each IG
+    # Resolve every IG's dependency closure first, so packages shared between
+    # IGs are scanned once and all scanning happens in a single process pool
+    all_packages: Dict[str, Tuple[str, str]] = {}
     for ig in igs:
         ig_id = ig.get("id")
         ig_version = ig.get("version")
@@ -1264,42 +2125,48 @@ def main() -> int:
         if not packages:
             logging.warning("No packages found for %s#%s", ig_id, ig_version)
             continue
-
         for package_id, version, package_dir in packages:
-            logging.info("Scanning %s#%s", package_id, version)
-            bound_valuesets.extend(extract_bound_valuesets(package_dir))
-            valueset_index.update(collect_valuesets(package_dir))
+            all_packages.setdefault(package_dir, (package_id, version))
+
+    logging.info("Scanning %d packages", len(all_packages))
+    scan_cache = None if args.no_cache else os.path.join(data_folder, "cache", "scan")
+    scanned = scan_packages(list(all_packages), cache_folder=scan_cache)
+    for (package_id, version), (package_bindings, package_valuesets) in zip(all_packages.values(), scanned):
+        logging.debug("Scanned %s#%s", package_id, version)
+        for url, valueset in package_valuesets.items():
+            valueset_index.setdefault(url, valueset)
+        for item in package_bindings:
+            key = (item.valueset_url, item.structure_definition_url)
+            if key not in bound_valuesets:
+                bound_valuesets[key] = item
 
     if not bound_valuesets:
         logging.error("No bound valuesets found in any IG")
         return 1
 
-    seen: Set[Tuple[str, str]] = set()
-    deduped: List[Dict[str, str]] = []
-    for item in bound_valuesets:
-        key = (item.get("valueset_url", ""), item.get("structure_definition_url", ""))
-        if key not in seen:
-            seen.add(key)
-            deduped.append(item)
-
+    deduped = list(bound_valuesets.values())
     logging.info("Found %d unique ValueSets bound in elements", len(deduped))
 
     # Dev mode: limit to a sample of NCTS valuesets for faster testing
     # This sample should include valuesets across different count ranges (low, medium, high)
     if dev_mode:
         # Filter to only NCTS valuesets
-        ncts_deduped = [vs for vs in deduped if is_ncts_valueset(vs.get("valueset_url", ""))]
+        ncts_deduped = [vs for vs in deduped if is_ncts_valueset(vs.valueset_url)]
         
         # Take every 3rd valueset to get better distribution across count ranges
         # This gives us a more representative sample than just taking the first N
-        sampled = [ncts_deduped[i] for i in range(0, min(150, len(ncts_deduped)), 3)]
-        deduped = sampled[:50]  # Limit to 50 for reasonable runtime
+        deduped = ncts_deduped[:DEV_SAMPLE_WINDOW:3][:50]  # Limit to 50 for reasonable runtime
         logging.info("DEV MODE: Limited to %d valuesets for testing (sampled every 3rd)", len(deduped))
 
     versions = compute_versions(versions_to_compare)
     
     # Validate that versions are available on the server (filters out unreleased versions)
-    versions = validate_versions_on_server(endpoint, valueset_index, versions)
+    if args.no_cache:
+        versions = validate_versions_on_server(endpoint, valueset_index, versions, max_workers)
+    else:
+        versions = validate_versions_cached(
+            endpoint, valueset_index, versions, os.path.join(data_folder, "cache", "versions.json"), max_workers
+        )
     
     if not versions:
         logging.error("No valid versions found on terminology server")
@@ -1309,8 +2176,9 @@ def main() -> int:
     if args.sctver:
         # User specified latest SNOMED CT AU version
         try:
-            max_version_date = dt.datetime.strptime(args.sctver, "%Y%m%d").date()
+            max_version_date = parse_version_date(args.sctver)
             logging.info("Using SNOMED CT AU version cutoff: %s", args.sctver)
+            reason = f"newer than specified SNOMED CT AU version {args.sctver}"
         except ValueError:
             logging.error("Invalid sctver format: %s (expected YYYYMMDD)", args.sctver)
             return 1
@@ -1319,73 +2187,63 @@ def main() -> int:
         today = dt.date.today()
         max_version_date = today + dt.timedelta(days=7)
         logging.info("Using default cutoff: 7 days in future from %s", today)
+        reason = "more than 7 days in the future"
     
+    # Valid YYYYMMDD strings order the same way as the dates they name, so a
+    # version that parses is compared to the cutoff as a string
+    cutoff_version = max_version_date.strftime("%Y%m%d")
     filtered_versions = []
     for version in versions:
         try:
-            version_date = dt.datetime.strptime(version, "%Y%m%d").date()
-            if version_date > max_version_date:
-                if args.sctver:
-                    logging.info(
-                        "Removing version %s: newer than specified SNOMED CT AU version %s",
-                        version, args.sctver
-                    )
-                else:
-                    logging.info(
-                        "Removing version %s: more than 7 days in the future",
-                        version
-                    )
-            else:
-                filtered_versions.append(version)
+            parse_version_date(version)
         except ValueError:
             logging.warning("Invalid version date format: %s", version)
             continue
+        if version > cutoff_version:
+            logging.info("Removing version %s: %s", version, reason)
+        else:
+            filtered_versions.append(version)
     
     versions = filtered_versions
     if not versions:
         logging.error("No versions remain after filtering")
         return 1
 
-    rows = build_rows(deduped, valueset_index, versions, endpoint)
-    
-    # Filter out version columns that have no data across all rows
-    versions_with_data = []
-    for version in versions:
-        has_data = any(row.get(version) != "" and row.get(version) is not None for row in rows)
-        if has_data:
-            versions_with_data.append(version)
-    
-    # Remove empty version columns from rows
-    for row in rows:
-        for version in versions:
-            if version not in versions_with_data:
+    cache: Optional[ExpandCache] = None
+    if not args.no_cache:
+        cache_path = os.path.join(data_folder, "cache", "expand.sqlite")
+        try:
+            cache = ExpandCache(cache_path, cache_ttl_hours * 3600, history_cache_ttl_days * 86400)
+        except (OSError, sqlite3.Error) as exc:
+            logging.warning("Expansion cache unavailable (%s): %s", cache_path, exc)
+
+    try:
+        rows = build_rows(
+            deduped, valueset_index, versions, endpoint,
+            max_workers=max_workers, cache=cache, batch=batch_expand, use_async=async_expand,
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+    
+    # Remove version columns that have no data across all rows. The check for
+    # each column stops at its first count, so only empty columns are read in
+    # full, and only those are then popped from the rows.
+    empty_versions = [
+        version for version in versions
+        if all(row.get(version) in ("", None) for row in rows)
+    ]
+    if empty_versions:
+        for row in rows:
+            for version in empty_versions:
                 row.pop(version, None)
     
     # Sort rows by ValueSet Name
     rows.sort(key=lambda r: str(r.get("valueset_name", "")).lower())
 
     write_tsv(rows, output_path, versions)
-    write_html(rows, html_output_path, versions, endpoint, versions_to_compare, igs)
-    
-    # Create HTML charts (3 separate charts by count range)
-    chart_output_path = output_path.replace(".tsv", "-chart.html")
-    chart_low_path, chart_medium_path, chart_high_path = write_chart_html(rows, chart_output_path, versions)
-
     logging.info("Wrote %s", output_path)
-    logging.info("Wrote %s", html_output_path)
-    logging.info("Wrote %s", chart_low_path)
-    logging.info("Wrote %s", chart_medium_path)
-    logging.info("Wrote %s", chart_high_path)
-    
-    # Create web-ready folder with index.html
-    web_folder = create_web_folder(data_folder, html_output_path, 
-                                   chart_low_path, chart_medium_path, chart_high_path,
-                                   endpoint, versions_to_compare, igs)
-    logging.info("Created web folder: %s", web_folder)
-    print(f"\n✓ Web folder ready for deployment: {web_folder}")
-    print(f"  - Upload the contents of this folder to your web host")
-    print(f"  - Open index.html in a browser to view the dashboard")
-    
+    write_reports(rows, versions, output_path, html_output_path, data_folder, endpoint, versions_to_compare, igs)
     return 0
 
 